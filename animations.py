@@ -5,6 +5,8 @@ from collections import defaultdict
 import bpy
 from mathutils import Euler
 
+from .mesh_builder import select_only
+
 
 def create_animations(item_idx, rig, bonenames, animations, options):
     if rig.animation_data is None:
@@ -57,9 +59,7 @@ def create_animations(item_idx, rig, bonenames, animations, options):
         track.strips.new(action.name, start=0, action=action)
 
     if options.export_fbx:
-        bpy.ops.object.select_all(action='DESELECT')
-        rig.select_set(True)
-        bpy.context.view_layer.objects.active = rig
+        select_only([rig], rig)
         filepath = options.path + '\\{}.fbx'.format(rig.name)
         bpy.ops.export_scene.fbx(
             filepath=filepath, axis_forward='Z', use_selection=True,
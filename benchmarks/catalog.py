@@ -0,0 +1,39 @@
+"""Time the ways the slot names of trcatalog.xml are loaded
+
+ET.parse alone is the cost of building the whole tree, which any loader
+walking the tree afterwards would pay first.
+
+usage: python benchmarks/catalog.py [repeat]"""
+import os
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import objects  # noqa: E402
+
+
+def stream():
+    catalog = objects.Catalog.load()
+    return {game: catalog.names(game) for game in objects.GAMES}
+
+
+def compiled():
+    # json files written by compile_catalog, as read on the next sessions
+    objects.get_names.cache_clear()
+    return {game: objects.get_names(game) for game in objects.GAMES}
+
+
+def main(repeat=20):
+    objects.compile_catalog()
+    assert compiled() == stream()
+    for name, loader in (('ET.parse only', lambda: ET.parse(objects.catalog_path)),
+                         ('Catalog.load', objects.Catalog.load),
+                         ('Catalog.load + names', stream),
+                         ('compiled json, every game', compiled)):
+        best = min(timeit.repeat(loader, number=1, repeat=repeat))
+        print('{:<34} {:8.2f} ms'.format(name, best * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
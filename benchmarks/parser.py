@@ -0,0 +1,237 @@
+"""Time the stages of readWAD on synthetic WADs
+
+usage: python benchmarks/parser.py [--size small medium large] [--save]
+
+Each stage is run --repeat times on the same content and the best time is
+kept. Timings depend on the machine, so no baseline is shipped: --save
+stores the results in baseline.json, and later runs are compared with it.
+The exit status is 1 when a stage is slower than baseline * --tolerance,
+unless the baseline was saved in another environment."""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from wad import model, read  # noqa: E402
+import synth  # noqa: E402
+
+SIZES = {
+    'small': {},
+    'medium': dict(pages=8, texture_samples=1000, meshes=500, vertices=100,
+                   polygons=150, movables=60, meshes_per_movable=10,
+                   animations=20, frames=30, statics=150),
+    'large': dict(pages=16, texture_samples=4000, meshes=2000, vertices=200,
+                  polygons=300, movables=150, meshes_per_movable=12,
+                  animations=40, frames=40, statics=400),
+}
+
+STAGES = ['tables', 'texture_map', 'meshes', 'animations',
+          'keyframes', 'post_processing', 'total']
+
+# stages faster than this are too noisy to be compared
+MIN_COMPARED_TIME = 0.002
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def run_stages(content, options, compact):
+    """time the steps of readWAD one after another"""
+    times = {}
+    clock = time.perf_counter
+
+    # the first pass over the tables, texture samples included
+    start = clock()
+    reader = read.WadReader(content, options, compact)
+    times['tables'] = clock() - start
+
+    start = clock()
+    texture_map = reader.read_texture_map()
+    texture_pages = reader.read_texture_pages()
+    times['texture_map'] = clock() - start
+
+    start = clock()
+    reader.decode_meshes()
+    for pointer in set(reader.mesh_pointers):
+        reader.read_mesh(pointer)
+    times['meshes'] = clock() - start
+
+    start = clock()
+    movables = []
+    keyframes_layouts = []
+    for mov_idx in range(len(reader.movables_data)):
+        animations, layouts = reader.movable_animations(mov_idx)
+        keyframes_layouts += layouts
+        movables.append(animations)
+    times['animations'] = clock() - start
+
+    start = clock()
+    keyframes = read.read_keyframes(reader.keyframes_data,
+                                    [layout for _, layout in keyframes_layouts])
+    times['keyframes'] = clock() - start
+
+    start = clock()
+    for (animation, _), animation_keyframes in zip(keyframes_layouts, keyframes):
+        animation.keyFrames = animation_keyframes
+    statics = [model.Static(static.obj_ID, reader.read_static_mesh(i))
+               for i, static in enumerate(reader.statics_data)]
+    movables = [model.Movable(mov_data.obj_ID, reader.read_movable_meshes(i),
+                              reader.read_movable_joints(i), movables[i])
+                for i, mov_data in enumerate(reader.movables_data)]
+    model.Wad(reader.version, statics, reader.map_width, reader.map_height,
+              texture_map, movables, texture_pages)
+    times['post_processing'] = clock() - start
+
+    start = clock()
+    read.readWAD(content, options, compact=compact)
+    times['total'] = clock() - start
+
+    counts = {
+        'bytes': len(content),
+        'polygons': sum(len(m.pages) if compact else len(m.polygons)
+                        for m in reader.meshes.values()),
+        'keyframes': sum(layout[1] for _, layout in keyframes_layouts),
+    }
+    return times, counts
+
+
+def peak_memory(content, options, compact):
+    tracemalloc.start()
+    wad = read.readWAD(content, options, compact=compact)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del wad
+    return peak
+
+
+def benchmark(content, options, compact, repeat):
+    best = {}
+    for _ in range(repeat):
+        times, counts = run_stages(content, options, compact)
+        for stage, seconds in times.items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+
+    return {
+        'times': best,
+        'throughput': {
+            'MB/s': counts['bytes'] / best['total'] / 1e6,
+            'polygons/s': counts['polygons'] / best['meshes'],
+            'keyframes/s': counts['keyframes'] / max(best['keyframes'], 1e-9),
+        },
+        'peak_memory': peak_memory(content, options, compact),
+        'size': counts,
+    }
+
+
+def environment():
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+
+    return {'python': platform.python_version(), 'numpy': numpy_version,
+            'machine': platform.machine()}
+
+
+def compare(name, result, baseline, tolerance):
+    """print the stages of result next to the baseline ones, return the
+    names of the slower stages"""
+    regressions = []
+    print('{} ({:.1f} MB, {} polygons, {} keyframes)'.format(
+        name, result['size']['bytes'] / 1e6, result['size']['polygons'],
+        result['size']['keyframes']))
+    for stage in STAGES:
+        seconds = result['times'][stage]
+        line = '  {:<16} {:9.2f} ms'.format(stage, seconds * 1000)
+        if baseline:
+            before = baseline['times'][stage]
+            ratio = seconds / before
+            line += '  {:9.2f} ms  x{:.2f}'.format(before * 1000, ratio)
+            if ratio > tolerance and max(seconds, before) >= MIN_COMPARED_TIME:
+                line += '  SLOWER'
+                regressions.append(stage)
+        print(line)
+
+    for key, value in result['throughput'].items():
+        print('  {:<16} {:12.1f}'.format(key, value))
+
+    line = '  {:<16} {:9.1f} MB'.format('peak memory', result['peak_memory'] / 1e6)
+    if baseline:
+        before = baseline['peak_memory']
+        line += '  {:9.1f} MB  x{:.2f}'.format(before / 1e6, result['peak_memory'] / before)
+        if result['peak_memory'] > before * tolerance:
+            line += '  LARGER'
+            regressions.append('peak memory')
+    print(line)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', nargs='+', choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument('-p', '--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a synth.generate argument, e.g. -p meshes=3000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--texture-pages', action='store_true')
+    parser.add_argument('--compact', action='store_true', help='build model.ArrayMesh')
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--save', action='store_true', help='store the results as baseline')
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for param in args.param:
+        key, value = param.split('=')
+        overrides[key] = int(value)
+
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {'environment': environment(), 'results': {}}
+
+    # timings of another environment are shown but do not fail the run
+    same_environment = baselines['environment'] == environment()
+    if not same_environment:
+        print('baseline environment {} differs from {}'.format(
+            baselines['environment'], environment()))
+
+    options = SimpleNamespace(texture_pages=args.texture_pages)
+    regressions = []
+    for size in args.size:
+        name = size
+        if overrides:
+            name += ',' + ','.join('{}={}'.format(k, v) for k, v in sorted(overrides.items()))
+        if args.texture_pages:
+            name += ',pages'
+        if args.compact:
+            name += ',compact'
+
+        content = synth.generate(**dict(SIZES[size], **overrides))
+        result = benchmark(content, options, args.compact, args.repeat)
+        baseline = None if args.save else baselines['results'].get(name)
+        regressions += [(name, stage) for stage in
+                        compare(name, result, baseline, args.tolerance)]
+        baselines['results'][name] = result
+
+    if args.save:
+        baselines['environment'] = environment()
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print('saved', args.baseline)
+    elif regressions:
+        print('regressions:', ', '.join('{} {}'.format(*e) for e in regressions))
+        if same_environment:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
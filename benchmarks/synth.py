@@ -0,0 +1,184 @@
+"""Synthetic WAD files for the benchmarks
+
+The content is random, but every table and package has the layout, sizes
+and cross references readWAD expects, so that all the parser paths run.
+
+usage: python benchmarks/synth.py OUTPUT.wad [seed]"""
+import random
+import struct
+import sys
+
+
+def mesh_bytes(rng, texture_samples_count, vertices_count, polygons_count, use_normals):
+    """a mesh with normals or shades, half triangles and half quads"""
+    out = bytearray()
+    out += struct.pack('3h 2H', rng.randint(-500, 500), rng.randint(-500, 500),
+                       rng.randint(-500, 500), rng.randint(1, 2000), 0)
+    out += struct.pack('H', vertices_count)
+    for _ in range(vertices_count):
+        out += struct.pack('3h', *(rng.randint(-2000, 2000) for _ in range(3)))
+    if use_normals:
+        out += struct.pack('h', vertices_count)
+        for _ in range(vertices_count):
+            out += struct.pack('3h', *(rng.randint(-16300, 16300) for _ in range(3)))
+    else:
+        out += struct.pack('h', -vertices_count)
+        for _ in range(vertices_count):
+            out += struct.pack('h', rng.randint(0, 8191))
+    out += struct.pack('H', polygons_count)
+    quads = 0
+    for _ in range(polygons_count):
+        idx = rng.randrange(texture_samples_count)
+        flipped = rng.random() < 0.2
+        attributes = rng.randrange(256)
+        if rng.random() < 0.5:
+            quads += 1
+            if flipped and idx > 0:
+                texture = 0x10000 - idx
+            else:
+                texture = idx
+            out += struct.pack('5H', 9, *rng.sample(range(vertices_count), 4))
+            out += struct.pack('H 2B', texture, attributes, 0)
+        else:
+            shape = rng.choice((0, 2, 4, 6))
+            texture = (int(flipped) << 15) | (shape << 12) | idx
+            out += struct.pack('4H', 8, *rng.sample(range(vertices_count), 3))
+            out += struct.pack('H 2B', texture, attributes, 0)
+    if quads % 2 == 1:
+        out += b'\0\0'
+    return bytes(out)
+
+
+def keyframe_bytes(rng, meshes_count, keyframe_size):
+    """bounding box, offset and a one or two words rotation per mesh"""
+    words = [rng.randint(-1000, 1000) & 0xFFFF for _ in range(9)]
+    for _ in range(meshes_count):
+        if len(words) + 2 <= keyframe_size and rng.random() < 0.6:
+            value = rng.getrandbits(30)
+            words += [value >> 16, value & 0xFFFF]
+        else:
+            words.append(rng.choice((0x4000, 0x8000, 0xC000)) | rng.getrandbits(14))
+    words += [0] * (keyframe_size - len(words))
+    return struct.pack('{}H'.format(len(words)), *words)
+
+
+def generate(seed=0, pages=4, texture_samples=200, meshes=60, vertices=24,
+             polygons=30, movables=10, meshes_per_movable=5, animations=6,
+             frames=8, statics=15, commands=3):
+    """WAD content with the given number of texture pages, texture samples,
+    meshes (of up to vertices vertices and polygons polygons), movables,
+    animations per movable (every third movable has none), keyframes per
+    animation, statics and commands per animation"""
+    rng = random.Random(seed)
+    out = bytearray(struct.pack('I', 129))
+
+    # texture samples
+    out += struct.pack('I', texture_samples)
+    for _ in range(texture_samples):
+        w, h = rng.randint(1, 64), rng.randint(1, 64)
+        page = rng.randrange(pages)
+        out += struct.pack('2B H b B b B', rng.randint(0, 256 - w),
+                           rng.randint(0, 256 - h), page,
+                           rng.choice((-1, 0)), w - 1, rng.choice((-1, 0)), h - 1)
+
+    # texture map
+    raw = bytearray(rng.getrandbits(8) for _ in range(256 * 256 * 3 * pages))
+    for i in range(0, len(raw), 97 * 3):
+        raw[i:i + 3] = b'\xff\x00\xff'
+    out += struct.pack('I', len(raw)) + raw
+
+    # meshes
+    mesh_package = bytearray()
+    offsets = []
+    for _ in range(meshes):
+        offsets.append(len(mesh_package))
+        mesh_package += mesh_bytes(rng, texture_samples, rng.randint(4, vertices),
+                                   rng.randint(1, polygons), rng.random() < 0.5)
+    pointers = []
+    for _ in range(movables * meshes_per_movable + statics):
+        pointers.append(rng.choice(offsets))
+    out += struct.pack('I', len(pointers))
+    out += struct.pack('{}I'.format(len(pointers)), *pointers)
+    out += struct.pack('I', len(mesh_package) // 2) + mesh_package
+
+    # animations, state changes, dispatches, commands, keyframes
+    anim_records = []
+    state_changes = []
+    dispatches = []
+    command_words = []
+    keyframes = bytearray()
+    anims_index = []
+    animations_total = 0
+    for mov in range(movables):
+        if mov % 3 == 2:
+            anims_index.append(-1)
+            continue
+        anims_index.append(animations_total)
+        for a in range(animations):
+            keyframe_size = 9 + 2 * meshes_per_movable
+            keyframe_offset = len(keyframes)
+            for _ in range(frames):
+                keyframes += keyframe_bytes(rng, meshes_per_movable, keyframe_size)
+            changes_index = len(state_changes)
+            num_changes = rng.randint(0, 2)
+            for _ in range(num_changes):
+                dispatches_index = len(dispatches)
+                num_dispatches = rng.randint(0, 2)
+                for _ in range(num_dispatches):
+                    dispatches.append((0, frames, animations_total + rng.randrange(animations), 0))
+                state_changes.append((rng.randrange(100), num_dispatches, dispatches_index))
+            commands_offset = len(command_words)
+            num_commands = rng.randint(0, commands)
+            for _ in range(num_commands):
+                op = rng.choice((1, 2, 3, 4, 5, 6))
+                command_words.append(op)
+                if op == 1:
+                    command_words += [rng.randint(0, 100) for _ in range(3)]
+                elif op == 2:
+                    command_words += [rng.randint(0, 100) for _ in range(2)]
+                elif op in (5, 6):
+                    command_words += [rng.randint(0, 100) for _ in range(2)]
+            anim_records.append(struct.pack(
+                'I 2B H 2h i q 8H', keyframe_offset, 1, keyframe_size,
+                rng.randrange(100), 0, rng.randint(-50, 50),
+                rng.randint(-65536, 65536), 0, 0, frames - 1,
+                animations_total + rng.randrange(animations), 0,
+                num_changes, changes_index,
+                num_commands, commands_offset if num_commands else 0))
+        animations_total += animations
+
+    out += struct.pack('I', len(anim_records)) + b''.join(anim_records)
+    out += struct.pack('I', len(state_changes))
+    out += b''.join(struct.pack('3H', *e) for e in state_changes)
+    out += struct.pack('I', len(dispatches))
+    out += b''.join(struct.pack('4H', *e) for e in dispatches)
+    out += struct.pack('I', len(command_words))
+    out += struct.pack('{}H'.format(len(command_words)), *command_words)
+
+    links = []
+    for mov in range(movables):
+        for _ in range(meshes_per_movable - 1):
+            links += [rng.choice((0, 1, 2, 3)), rng.randint(-300, 300),
+                      rng.randint(-300, 300), rng.randint(-300, 300)]
+    out += struct.pack('I', len(links))
+    out += struct.pack('{}i'.format(len(links)), *links)
+
+    out += struct.pack('I', len(keyframes) // 2) + keyframes
+
+    out += struct.pack('I', movables)
+    for mov in range(movables):
+        out += struct.pack('I 2H 2I h', mov, meshes_per_movable,
+                           mov * meshes_per_movable,
+                           mov * (meshes_per_movable - 1) * 4, 0, anims_index[mov])
+
+    out += struct.pack('I', statics)
+    for s in range(statics):
+        out += struct.pack('I H 12h H', s, movables * meshes_per_movable + s,
+                           *(rng.randint(-100, 100) for _ in range(12)), 0)
+
+    return bytes(out)
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'wb') as f:
+        f.write(generate(*map(int, sys.argv[2:3])))
@@ -1,10 +1,13 @@
+from array import array
 from os import path
 from math import floor
 
 import bpy
-import bmesh
 
 from . import sprytile_utils as sprytile
+from .mesh_builder import add_color_layer, add_gray_layer
+from .wad import model
+from .wad.read import UV_ORDERS
 
 def generateNodesSetup(name, uvmap):
     if name in bpy.data.materials:
@@ -79,43 +82,126 @@ def generateNodesSetup(name, uvmap):
     return mat
 
 
-def setShineOpacity(obj, face, polygon, roughness_layer, opacity_layer):
-    if obj.get('opacity') is not None:
-        for loop in face.loops:
-            intensity = 1 - polygon.intensity / 31 if polygon.shine == 1 else 0
-            loop[roughness_layer] = (intensity, intensity, intensity, 1)
-
-            alpha = polygon.opacity
-            loop[opacity_layer] = (alpha, alpha, alpha, 1)
+# corners (a, b, c, d) of the uv rect used by the loops of a polygon:
+# triangles by polygon order, quads in the last row
+LOOP_CORNERS = ((0, 1, 3, 0), (3, 0, 2, 0), (1, 2, 0, 0), (3, 0, 2, 0),
+                (2, 3, 1, 0), (3, 0, 2, 0), (3, 0, 2, 0), (3, 0, 2, 0),
+                (0, 1, 2, 3))
+
+
+def loop_uvs(mesh, uv_rects):
+    """flat uvs of the loops of an ArrayMesh, uv_rects has the 8
+    coordinates of the uv corners (a, b, c, d) of each polygon"""
+    try:
+        import numpy as np
+        HAS_NUMPY = True
+    except ImportError:
+        HAS_NUMPY = False
+
+    if HAS_NUMPY:
+        counts = np.diff(np.frombuffer(mesh.face_starts, dtype=np.uint32)).astype(np.int64)
+        attributes = np.frombuffer(mesh.attributes, dtype=np.uint16)
+        orders = model.unpack_attribute(attributes, model.ORDER)
+        rows = np.where(counts == 4, len(LOOP_CORNERS) - 1, orders)
+        used = np.arange(4) < counts[:, None]
+        corners = np.array(LOOP_CORNERS)[rows][used]
+        polygons = np.repeat(np.arange(len(counts)), counts)
+        uv_rects = np.asarray(uv_rects, dtype=np.float32).reshape(-1, 4, 2)
+        return uv_rects[polygons, corners].ravel()
+
+    uvs = array('f')
+    starts = mesh.face_starts
+    for i, attributes in enumerate(mesh.attributes):
+        count = starts[i + 1] - starts[i]
+        row = -1 if count == 4 else model.unpack_attribute(attributes, model.ORDER)
+        for k in LOOP_CORNERS[row][:count]:
+            uvs.extend(uv_rects[8 * i + 2 * k:8 * i + 2 * k + 2])
+    return uvs
+
+
+def packed_uv_rects(mesh, uvtable, map_width, map_height):
+    """uv corners of the polygons of an ArrayMesh in the texture map built
+    by texture_packer.pack_object_textures"""
+    import numpy as np
+
+    r = mesh.texture_rects
+    x, y = np.array([uvtable[key] for key in zip(r[0::4], r[1::4], r[2::4], r[3::4])],
+                    dtype=np.float64).reshape(-1, 2).T
+    w = np.frombuffer(r, dtype=np.uint16)[2::4]
+    h = np.frombuffer(r, dtype=np.uint16)[3::4]
+    left, top = x / map_width, 1 - y / map_height
+    right, bottom = (x + w) / map_width, 1 - (y + h) / map_height
+    corners = np.stack((left, top, right, top, right, bottom, left, bottom), axis=1).reshape(-1, 4, 2)
+
+    attributes = np.frombuffer(mesh.attributes, dtype=np.uint16)
+    flips = np.where(model.unpack_attribute(attributes, model.FLIP_Y) == 1, 2,
+                     model.unpack_attribute(attributes, model.FLIP_X))
+    orders = np.array(UV_ORDERS)[flips]
+    return corners[np.arange(len(flips))[:, None], orders].ravel()
+
+
+def sprytile_faces(mesh, uv_rects, tiles_width, tiles_height):
+    """(width, height, tile_x, tile_y, flipx, flipy) of the polygons of an
+    ArrayMesh, the tile is the smallest corner of the uv rect"""
+    faces = []
+    uv_rects = uv_rects.tolist()
+    r = mesh.texture_rects
+    for i, attributes in enumerate(mesh.attributes):
+        uv = uv_rects[8 * i:8 * i + 8]
+        u, v = min(zip(uv[0::2], uv[1::2]))
+        faces.append((r[4 * i + 2], r[4 * i + 3], floor(u * tiles_width), floor(v * tiles_height),
+                      model.unpack_attribute(attributes, model.FLIP_X),
+                      model.unpack_attribute(attributes, model.FLIP_Y)))
+    return faces
+
+
+def set_uvs(mesh_data, uvs):
+    uv_layer = mesh_data.uv_layers.active or mesh_data.uv_layers.new()
+    uv_layer.data.foreach_set('uv', uvs)
+
+
+def add_shine_opacity_layers(obj, mesh):
+    """'shine' and 'opacity' vertex color layers from the polygons of an
+    ArrayMesh, black unless obj has the 'opacity' property of movables"""
+    mesh_data = obj.data
+    if obj.get('opacity') is None:
+        add_color_layer(mesh_data, 'shine', (0, 0, 0, 1))
+        add_color_layer(mesh_data, 'opacity', (0, 0, 0, 1))
+        return
+
+    try:
+        import numpy as np
+        HAS_NUMPY = True
+    except ImportError:
+        HAS_NUMPY = False
+
+    if HAS_NUMPY:
+        attributes = np.frombuffer(mesh.attributes, dtype=np.uint16)
+        counts = np.diff(np.frombuffer(mesh.face_starts, dtype=np.uint32)).astype(np.int64)
+        intensity = model.unpack_attribute(attributes, model.INTENSITY)
+        shine = np.where(model.unpack_attribute(attributes, model.SHINE) == 1,
+                         1 - intensity / 31, 0)
+        opacity = model.unpack_attribute(attributes, model.OPACITY)
+        shine = np.repeat(shine, counts)
+        opacity = np.repeat(opacity, counts)
     else:
-        for loop in face.loops:
-            intensity = 0
-            loop[roughness_layer] = (0, 0, 0, 1)
-            loop[opacity_layer] = (0, 0, 0, 1)
-
-
-def setUV(face, polygon, uvrect, uv_layer):
-    a, b, c, d = uvrect
-    if len(polygon.face) == 4:
-        uv = (a, b, c, d)
-    else:
-        if polygon.order == 0:
-            uv = (a, b, d)
-        elif polygon.order == 2:
-            uv = (b, c, a)
-        elif polygon.order == 4:
-            uv = (c, d, b)
-        else:
-            uv = (d, a, c)
-
-    k = 0
-    for loop in face.loops:
-        loop[uv_layer].uv = uv[k]
-        k += 1
-
-
-def createPageMaterial(filepath, context):
-    sprytile_installed = sprytile.check_install()
+        shine = array('f')
+        opacity = array('f')
+        starts = mesh.face_starts
+        for i, attributes in enumerate(mesh.attributes):
+            count = starts[i + 1] - starts[i]
+            intensity = model.unpack_attribute(attributes, model.INTENSITY)
+            if model.unpack_attribute(attributes, model.SHINE) == 1:
+                shine.extend([1 - intensity / 31] * count)
+            else:
+                shine.extend([0] * count)
+            opacity.extend([model.unpack_attribute(attributes, model.OPACITY)] * count)
+
+    add_gray_layer(mesh_data, 'shine', shine)
+    add_gray_layer(mesh_data, 'opacity', opacity)
+
+
+def createPageMaterial(filepath, context, deferred=None):
     obj = context.object
 
     material_name = filepath[filepath.rindex(path.sep) + 1: filepath.rindex('.')]
@@ -130,8 +216,8 @@ def createPageMaterial(filepath, context):
     target_mat = mat # obj.material_slots[obj.active_material_index].material
     target_mat.name = material_name
 
-    if sprytile_installed:
-        sprytile.update(context)
+    if deferred is not None:
+        deferred.add_material(target_mat)
 
     return target_mat
 
@@ -141,8 +227,6 @@ def pack_textures(context, meshes, objects, options, name):
     from PIL import Image
     from .texture_packer import pack_object_textures
 
-    sprytile_installed = sprytile.check_install()
-
     texture_path = options.path + options.wadname + ".png"
     uvtable, new_texture_map = pack_object_textures(meshes, texture_path)
 
@@ -153,83 +237,32 @@ def pack_textures(context, meshes, objects, options, name):
     im.save(path)
     mats = [generateNodesSetup(name, path)]
 
+    mw, mh = new_texture_map.shape[1], new_texture_map.shape[0]
     for mesh, obj in zip(meshes, objects):
-        sprytile.assign_material(context, obj, mats[0], sprytile_installed)
-        bm = bmesh.new()
-        bm.from_mesh(obj.data)
-        uv_layer = bm.loops.layers.uv.verify()
-        roughness_layer = bm.loops.layers.color.new("shine")
-        opacity_layer = bm.loops.layers.color.new("opacity")
-        sprytile.verify_bmesh_layers(bm)
-        for face_idx, (polygon, face) in enumerate(zip(mesh.polygons, bm.faces)):
-            a, b, c, d = polygon.tbox
-
-            x0, y0 = polygon.x, polygon.y
-            w, h = polygon.tex_width, polygon.tex_height
-            mw, mh = new_texture_map.shape[1], new_texture_map.shape[0]
-
-            p = uvtable[(x0, y0, w, h)]  # top left corner
-            left, top = p[0] / mw, 1 - p[1] / mh
-            right, bottom = (p[0] + w) / mw, 1 - (p[1] + h) / mh
-
-            a = (left, top)
-            b = (right, top)
-            c = (right, bottom)
-            d = (left, bottom)
-
-            tile = min(a, b, c, d)
-            tile_x, tile_y = tile
-            tile_x = floor(tile_x * (mw+1))
-            tile_y = floor(tile_y * (mh+1))
-
-            uvrect = [a, b, c, d]
-            if polygon.flipX:
-                uvrect = [b, a, d, c]
-
-            if polygon.flipY:
-                uvrect = [d, c, b, a]
-
-            face.material_index = 0
-            setUV(face, polygon, uvrect, uv_layer)
-            setShineOpacity(obj, face, polygon, roughness_layer, opacity_layer)
-
-            if sprytile_installed:
-                sprytile.write_metadata(
-                    context, obj, face_idx, bm, 
-                    polygon.tex_width, polygon.tex_height, 
-                    tile_x, tile_y, polygon.flipX, polygon.flipY, mw
-                )
-
-        bm.to_mesh(obj.data)
+        sprytile.assign_material(context, obj, mats[0], options.sprytile)
+        if not isinstance(mesh, model.ArrayMesh):
+            mesh = model.ArrayMesh.from_mesh(mesh)
+
+        uv_rects = packed_uv_rects(mesh, uvtable, mw, mh)
+        set_uvs(obj.data, loop_uvs(mesh, uv_rects))
+        add_shine_opacity_layers(obj, mesh)
+
+        if options.sprytile is not None:
+            faces = sprytile_faces(mesh, uv_rects, mw + 1, mh + 1)
+            options.sprytile.add_metadata(obj, faces, mw)
 
 
 def apply_textures(context, mesh, obj, materials, options, name=''):
-    sprytile_installed = sprytile.check_install()
     for i in range(len(materials)):
         obj.data.materials.append(materials[i])
 
-    bm = bmesh.new()
-    bm.from_mesh(obj.data)
-
-    uv_layer = bm.loops.layers.uv.verify()
-    roughness_layer = bm.loops.layers.color.new("shine")
-    opacity_layer = bm.loops.layers.color.new("opacity")
-    sprytile.verify_bmesh_layers(bm)
-    for idx, (polygon, face) in enumerate(zip(mesh.polygons, bm.faces)):
-        tile = min(polygon.tbox)
-        tile_x, tile_y = tile
-        tile_x = floor(tile_x * 256)
-        tile_y = floor(tile_y * 256)
-
-        face.material_index = polygon.page
-        setUV(face, polygon, polygon.tbox, uv_layer)
-        setShineOpacity(obj, face, polygon, roughness_layer, opacity_layer)
-
-        if sprytile_installed and options.texture_pages:
-            sprytile.write_metadata(
-                context, obj, idx, bm, 
-                polygon.tex_width, polygon.tex_height, 
-                tile_x, tile_y, polygon.flipX, polygon.flipY
-            )
-
-    bm.to_mesh(obj.data)
+    if not isinstance(mesh, model.ArrayMesh):
+        mesh = model.ArrayMesh.from_mesh(mesh)
+
+    obj.data.polygons.foreach_set('material_index', array('i', mesh.pages))
+    set_uvs(obj.data, loop_uvs(mesh, mesh.uv_rects))
+    add_shine_opacity_layers(obj, mesh)
+
+    if options.sprytile is not None and options.texture_pages:
+        faces = sprytile_faces(mesh, mesh.uv_rects, 256, 256)
+        options.sprytile.add_metadata(obj, faces)
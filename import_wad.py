@@ -7,7 +7,8 @@ from bpy_extras.io_utils import ImportHelper
 from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty
 
 from . import lara, movables, statics, objects, lara_rigless
-from .wad import read, preview
+from . import sprytile_utils as sprytile
+from .wad import read, preview, data, cache
 from .create_materials import generateNodesSetup, createPageMaterial
 
 
@@ -30,6 +31,24 @@ def rename_dups(obj_names):
                     obj_names[idx] += idx
 
 
+class GameNames(dict):
+    """game -> names table, loaded from the catalog when a game is first used"""
+
+    def __init__(self, table, dedup=False):
+        super().__init__()
+        self.table = table  # index in objects.get_names result
+        self.dedup = dedup
+
+    def __missing__(self, game):
+        names = objects.get_names(game)[self.table]
+        if self.dedup:
+            # the catalog tables are shared
+            names = dict(names)
+            rename_dups(names)
+        self[game] = names
+        return names
+
+
 class ImportWADContext:
     update_single_obj_chkbox = False
     selected_obj = 'None'
@@ -38,15 +57,10 @@ class ImportWADContext:
     last_objects_list = []
     cur_selected_file = ''
     has_numpy = check_requirements()
-    mov_names = {}
-    static_names = {}
-    anim_names = {}
-    state_names = {}
-    for game in ['TR1', 'TR2', 'TR3', 'TR4', 'TR5', 'TR5Main']:
-        mov_names[game], static_names[game], \
-        anim_names[game], state_names[game] = objects.get_names(game)
-        rename_dups(mov_names[game])
-        rename_dups(static_names[game])
+    mov_names = GameNames(0, dedup=True)
+    static_names = GameNames(1, dedup=True)
+    anim_names = GameNames(2)
+    state_names = GameNames(3)
 
 
     game = 'TR4'
@@ -193,6 +207,13 @@ class ImportWAD(Operator, ImportHelper):
         default='TR4',
     )
 
+    cache_dir: StringProperty(
+        name="Cache Folder",
+        description="Keep parsed wads in this folder to speed up re-imports of unchanged files. Leave empty to disable",
+        default="",
+        subtype='DIR_PATH',
+    )
+
     anims_names_opt: EnumProperty(
         name="Animation names",
         description="",
@@ -270,6 +291,7 @@ class ImportWAD(Operator, ImportHelper):
         box.prop(self, "flip_normals")
         box.label(text="Animation names")
         box.prop(self, "anims_names_opt", text="")
+        box.prop(self, "cache_dir")
 
     def execute(self, context):
 
@@ -288,6 +310,8 @@ class ImportWAD(Operator, ImportHelper):
         options.single_object = self.single_object
         options.object = ImportWADContext.selected_obj
         options.flip_normals = self.flip_normals
+        # sprytile grids are set up once, after all the objects are created
+        options.sprytile = sprytile.DeferredSetup() if sprytile.check_install() else None
         options.path, _ = os.path.split(options.filepath)
         options.path += '\\'
 
@@ -307,79 +331,98 @@ class ImportWAD(Operator, ImportHelper):
             options.texture_pages = False
 
 
+        # Lara option is only available for games >= TR4
+        t = self.batch_import_nolara if self.game in {
+            'TR1', 'TR2', 'TR3'} else self.batch_import
+
+        # a single object only decodes its own meshes and animations,
+        # meshes are array based to be uploaded with foreach_set
         with open(options.filepath, "rb") as f:
-            wad = read.readWAD(f, options)
-
-        materials = []
-        if options.texture_pages:
-            w = h = 256
-            if options.wadname + '_PAGE0' not in bpy.data.materials:
-                # create materials
-                for i, page in enumerate(wad.textureMaps):
-                    name = options.wadname + '_PAGE{}'.format(i)
-                    uvmap = bpy.data.images.new(name, w, h, alpha=True)
-                    uvmap.pixels = page
-                    texture_path = options.path + name + ".png"
-                    bpy.data.images[name].save_render(texture_path)
-                    material = createPageMaterial(texture_path, context)
-                    materials.append(material)
+            if options.single_object:
+                wad = read.readWAD(f, options, lazy=True, compact=True)
+            elif t in {'OPT_MOVABLES', 'OPT_STATICS'} and not self.cache_dir:
+                # objects are read once, and created as they are decoded
+                wad = read.stream_wad(f, options, compact=True)
+            elif self.cache_dir:
+                cache_dir = bpy.path.abspath(self.cache_dir)
+                wad = cache.readWAD(f, options, cache_dir)
             else:
-                # load existing materials
-                for i, page in enumerate(wad.textureMaps):
-                    name = options.wadname + '_PAGE{}'.format(i)
-                    material = bpy.data.materials[name]
-                    materials.append(material)
-        else:
-            # generate full texture map image
-            w, h = wad.mapwidth, wad.mapheight
-            uvmap = bpy.data.images.new(options.wadname, w, h, alpha=True)
-            uvmap.pixels = wad.textureMap
-            texture_path = options.path + options.wadname + ".png"
-            bpy.data.images[options.wadname].save_render(texture_path)
-            # create one material only if full texture option is checked
-            # otherwise materials are generated at the time of object creation
-            if not options.one_material_per_object:
-                materials = [generateNodesSetup(options.wadname, texture_path)]
-
-        if options.single_object:
-            # find selected object in movable or static list
-            found = False
-            for idx, name in options.mov_names.items():
-                if options.object == name:
-                    movables.main(context, materials, wad, options)
-                    found = True
-                    break
+                wad = read.readWAD(f, options, compact=True)
+
+        # the objects not decoded yet keep the file mapped until it is closed
+        try:
+            materials = []
+            if options.texture_pages:
+                w = h = 256
+                if options.wadname + '_PAGE0' not in bpy.data.materials:
+                    # create materials
+                    for i, page in enumerate(wad.textureMaps):
+                        name = options.wadname + '_PAGE{}'.format(i)
+                        uvmap = bpy.data.images.new(name, w, h, alpha=True)
+                        uvmap.pixels.foreach_set(data.pixels_to_float(page))
+                        texture_path = options.path + name + ".png"
+                        bpy.data.images[name].save_render(texture_path)
+                        material = createPageMaterial(texture_path, context, options.sprytile)
+                        materials.append(material)
+                else:
+                    # load existing materials
+                    for i, page in enumerate(wad.textureMaps):
+                        name = options.wadname + '_PAGE{}'.format(i)
+                        material = bpy.data.materials[name]
+                        materials.append(material)
             else:
-                if options.object.startswith('movable'):
-                    movables.main(context, materials, wad, options)
-                    found = True
-
-            if not found:
-                statics.main(context, materials, wad, options)
-        else:
-            # Batch import objects
-            # Lara option is only available for games >= TR4
-            t = self.batch_import_nolara if self.game in {
-                'TR1', 'TR2', 'TR3'} else self.batch_import
-            if t == 'OPT_LARA':
-                lara.main(context, materials, wad, options)
-            elif t == 'OPT_OUTFIT':
-                lara_rigless.main(context, materials, wad, options)
-            elif t == 'OPT_MOVABLES':
-                movables.main(context, materials, wad, options)
-            elif t == 'OPT_STATICS':
-                statics.main(context, materials, wad, options)
+                # generate full texture map image
+                w, h = wad.mapwidth, wad.mapheight
+                uvmap = bpy.data.images.new(options.wadname, w, h, alpha=True)
+                uvmap.pixels.foreach_set(data.pixels_to_float(wad.textureMap))
+                texture_path = options.path + options.wadname + ".png"
+                bpy.data.images[options.wadname].save_render(texture_path)
+                # create one material only if full texture option is checked
+                # otherwise materials are generated at the time of object creation
+                if not options.one_material_per_object:
+                    materials = [generateNodesSetup(options.wadname, texture_path)]
+
+            if options.single_object:
+                # find selected object in movable or static list
+                found = False
+                for idx, name in options.mov_names.items():
+                    if options.object == name:
+                        movables.main(context, materials, wad, options)
+                        found = True
+                        break
+                else:
+                    if options.object.startswith('movable'):
+                        movables.main(context, materials, wad, options)
+                        found = True
+
+                if not found:
+                    statics.main(context, materials, wad, options)
             else:
-                # Import everything
-                if self.game not in {'TR1', 'TR2', 'TR3'}:
+                # Batch import objects
+                if t == 'OPT_LARA':
                     lara.main(context, materials, wad, options)
+                elif t == 'OPT_OUTFIT':
+                    lara_rigless.main(context, materials, wad, options)
+                elif t == 'OPT_MOVABLES':
+                    movables.main(context, materials, wad, options)
+                elif t == 'OPT_STATICS':
+                    statics.main(context, materials, wad, options)
+                else:
+                    # Import everything
+                    if self.game not in {'TR1', 'TR2', 'TR3'}:
+                        lara.main(context, materials, wad, options)
+                        bpy.ops.object.select_all(action='DESELECT')
+
+                    movables.main(context, materials, wad, options)
                     bpy.ops.object.select_all(action='DESELECT')
+                    statics.main(context, materials, wad, options)
 
-                movables.main(context, materials, wad, options)
                 bpy.ops.object.select_all(action='DESELECT')
-                statics.main(context, materials, wad, options)
+        finally:
+            wad.close()
 
-            bpy.ops.object.select_all(action='DESELECT')
+        if options.sprytile is not None:
+            options.sprytile.finish(context)
 
         ImportWADContext.last_selected_file = 'None'
         ImportWADContext.last_objects_list.clear()
@@ -399,15 +442,14 @@ def item_cb(self, context):
         if os.path.exists(filepath):
             is_wad = filepath[-4:] in {'.wad', '.WAD'}
             if is_wad:
-                with open(filepath, "rb") as f:
-                    game = ImportWADContext.game
-                    movables, statics = preview.preview(
-                        f, ImportWADContext.mov_names[game],
-                        ImportWADContext.static_names[game])
-
-                    ImportWADContext.last_selected_file = filepath
-                    ImportWADContext.last_objects_list.clear()
-                    ImportWADContext.last_objects_list += movables + statics
+                game = ImportWADContext.game
+                movables, statics = preview.preview_file(
+                    filepath, game, ImportWADContext.mov_names[game],
+                    ImportWADContext.static_names[game])
+
+                ImportWADContext.last_selected_file = filepath
+                ImportWADContext.last_objects_list.clear()
+                ImportWADContext.last_objects_list += movables + statics
             else:
                 ImportWADContext.last_selected_file = filepath
                 ImportWADContext.last_objects_list.clear()
@@ -462,6 +504,8 @@ class InstallRequirements(bpy.types.Operator):
         subprocess.call([python_exe, "-m", "pip", "install", "numpy"])
         subprocess.call([python_exe, "-m", "pip", "install", "pillow"])
         ImportWADContext.has_numpy = check_requirements()
+        # the wad package looks for numpy once, when it is imported
+        data.detect_numpy()
 
         return{'FINISHED'}
 
@@ -1,10 +1,11 @@
 import os
-import math
 from collections import defaultdict
 
 import bpy
+from mathutils import Vector
 
 from .create_materials import apply_textures, pack_textures
+from .mesh_builder import WAD_AXES, add_color_layer, build_mesh, select_only
 from .animations import create_animations, save_animations_data
 from .objects import lara_skin_names, lara_skin_joints_names
 
@@ -114,6 +115,9 @@ def create_lara_skeleton(rig, pivot_points, lara_skin_meshes, lara_skin_joints_m
         for line in f:
             create_bone(*line.split())
 
+    for bone in amt.edit_bones:
+        bone.transform(WAD_AXES)
+
     # weight paint
     for mesh in lara_skin_meshes:
         bonename = mesh.name + '_BONE'
@@ -132,14 +136,6 @@ def create_lara_skeleton(rig, pivot_points, lara_skin_meshes, lara_skin_joints_m
         modifier.object = rig
 
 
-def paint_vertex(mesh):
-    vcol_layer = mesh.vertex_colors.new(name='shade')
-
-    for poly in mesh.polygons:
-        for loop_index in poly.loop_indices:
-            vcol_layer.data[loop_index].color = (0.5, 0.5, 0.5, 1.0)
-
-
 def main(context, materials, wad, options): 
     meshes2replace = {}
     meshes2replace['LARA'] = []
@@ -203,10 +199,6 @@ def main(context, materials, wad, options):
             mesh_objects = []
             bodyparts_names = []
             for j, m in enumerate(movable.meshes):
-                verts = [[v/options.scale for v in e] for e in m.vertices]
-                faces = [e.face for e in m.polygons]
-                normals = m.normals
-
                 if movable_name == 'LARA_SKIN':
                     bodypart_name = lara_skin_names[j] 
                 elif movable_name == 'LARA_SKIN_JOINTS':
@@ -217,11 +209,7 @@ def main(context, materials, wad, options):
                 bodyparts_names.append(bodypart_name)
 
                 mesh_name = anim + '_' + bodypart_name
-                mesh_data = bpy.data.meshes.new(mesh_name)
-                mesh_data.from_pydata(verts, [], faces)
-                if normals:
-                    for v, n in zip(mesh_data.vertices, normals):
-                        v.normal = n
+                mesh_data = build_mesh(mesh_name, m, options.scale, WAD_AXES)
 
                 mesh_obj = bpy.data.objects.new(mesh_name, mesh_data)
                 col.objects.link(mesh_obj)
@@ -238,14 +226,14 @@ def main(context, materials, wad, options):
                 mesh_objects.append(mesh_obj)
 
 
-                paint_vertex(mesh_data)
+                add_color_layer(mesh_data, 'shade', (0.5, 0.5, 0.5, 1.0))
 
 
             movables[movable_name] = mesh_objects
             ppoints = extract_pivot_points(bodyparts_names, movable.joints, options.scale)
             pivot_points[movable_name] = ppoints
             for bodypart, obj in zip(bodyparts_names, mesh_objects):
-                obj.location = ppoints[bodypart]
+                obj.location = WAD_AXES @ Vector(ppoints[bodypart])
 
         if options.one_material_per_object:
             pack_textures(context, meshes2, lara_objs, options, anim)
@@ -278,27 +266,16 @@ def main(context, materials, wad, options):
 
         bonenames = [mesh_data.name + '_BONE' for mesh_data in movables['LARA_SKIN']]
 
-        rig.rotation_mode = 'ZXY'
         bpy.ops.object.mode_set(mode="OBJECT")
-        rig.rotation_euler[1] = math.pi
-        rig.rotation_euler[0] = math.pi/2
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 
         if options.export_fbx:
             filepath = options.path + '\\{}.fbx'.format(anim)
-            bpy.ops.object.select_all(action='DESELECT')
-
-            bpy.context.view_layer.objects.active = rig
-            for obj in col.objects:
-                obj.select_set(True)
+            select_only(col.objects, rig)
             bpy.ops.export_scene.fbx(filepath=filepath, axis_forward='Z', use_selection=True, add_leaf_bones=False, bake_anim_use_all_actions =False)
 
         if options.export_obj:
             filepath = options.path + '\\{}.obj'.format(anim)
-
-            bpy.ops.object.select_all(action='DESELECT')
-            for obj in col.objects:
-                obj.select_set(True)
+            select_only(col.objects)
             bpy.ops.export_scene.obj(filepath=filepath, axis_forward='Z', use_selection=True)
 
         if options.import_anims:
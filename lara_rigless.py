@@ -5,6 +5,7 @@ from collections import defaultdict
 import bpy
 
 from .create_materials import apply_textures, pack_textures
+from .mesh_builder import add_color_layer, build_mesh
 from .objects import lara_skin_names, lara_skin_joints_names
 
 
@@ -131,14 +132,6 @@ def create_lara_skeleton(rig, pivot_points, lara_skin_meshes, lara_skin_joints_m
         modifier.object = rig
 
 
-def paint_vertex(mesh):
-    vcol_layer = mesh.vertex_colors.new(name='shade')
-
-    for poly in mesh.polygons:
-        for loop_index in poly.loop_indices:
-            vcol_layer.data[loop_index].color = (0.5, 0.5, 0.5, 1.0)
-
-
 def main(context, materials, wad, options): 
     main_collection = bpy.data.collections.get('Collection')
     col_lara = bpy.data.collections.new('Outfit')
@@ -174,18 +167,10 @@ def main(context, materials, wad, options):
             else:
                 continue
 
-            verts = [[v/options.scale for v in e] for e in m.vertices]
-            faces = [e.face for e in m.polygons]
-            normals = m.normals
-
             bodyparts_names.append(bodypart_name)
 
             mesh_name = bodypart_name
-            mesh_data = bpy.data.meshes.new(mesh_name)
-            mesh_data.from_pydata(verts, [], faces)
-            if normals:
-                for v, n in zip(mesh_data.vertices, normals):
-                    v.normal = n
+            mesh_data = build_mesh(mesh_name, m, options.scale)
 
             mesh_obj = bpy.data.objects.new(mesh_name, mesh_data)
             col.objects.link(mesh_obj)
@@ -202,7 +187,7 @@ def main(context, materials, wad, options):
             mesh_objects.append(mesh_obj)
 
 
-            paint_vertex(mesh_data)
+            add_color_layer(mesh_data, 'shade', (0.5, 0.5, 0.5, 1.0))
 
 
         movables[movable_name] = mesh_objects
@@ -0,0 +1,162 @@
+import math
+from array import array
+
+import bpy
+from mathutils import Euler
+
+from .wad import model
+
+# rotation from the wad axes to the blender ones, (x, y, z) -> (-x, -z, -y),
+# baked into the vertices and bones of the imported objects
+WAD_AXES = Euler((-math.pi / 2, 0, -math.pi), 'XYZ').to_matrix()
+
+
+def rotate(coords, matrix):
+    """flat x, y, z coordinates multiplied by a 3x3 matrix"""
+    (a, b, c), (d, e, f), (g, h, i) = matrix
+    rotated = array('f')
+    for x, y, z in zip(coords[0::3], coords[1::3], coords[2::3]):
+        rotated.extend((a * x + b * y + c * z, d * x + e * y + f * z, g * x + h * y + i * z))
+    return rotated
+
+
+def build_mesh(name, mesh, scale, matrix=None):
+    """new Blender mesh with the vertices, faces and normals of a wad mesh
+
+    The geometry is uploaded with foreach_set from the flat arrays of a
+    model.ArrayMesh, other meshes are converted first. matrix is an
+    optional 3x3 rotation applied to the vertices and normals."""
+    if not isinstance(mesh, model.ArrayMesh):
+        mesh = model.ArrayMesh.from_mesh(mesh)
+
+    try:
+        import numpy as np
+        HAS_NUMPY = True
+    except ImportError:
+        HAS_NUMPY = False
+
+    if HAS_NUMPY:
+        coords = np.frombuffer(mesh.coords, dtype=np.int16) / scale
+        normals = np.frombuffer(mesh.normal_coords, dtype=np.float32)
+        if matrix is not None:
+            rotation = np.array(matrix, dtype=np.float64)
+            coords = (coords.reshape(-1, 3) @ rotation.T).ravel()
+            normals = (normals.reshape(-1, 3) @ rotation.T).ravel()
+        coords = coords.astype(np.float32)
+        normals = normals.astype(np.float32)
+        vertex_indices = np.frombuffer(mesh.face_indices, dtype=np.uint16).astype(np.int32)
+        starts = np.frombuffer(mesh.face_starts, dtype=np.uint32).astype(np.int32)
+        loop_starts = starts[:-1]
+        loop_totals = np.diff(starts)
+    else:
+        coords = array('f', [c / scale for c in mesh.coords])
+        normals = mesh.normal_coords
+        if matrix is not None:
+            coords = rotate(coords, matrix)
+            normals = rotate(normals, matrix)
+        vertex_indices = array('i', mesh.face_indices)
+        starts = mesh.face_starts
+        loop_starts = array('i', starts[:-1])
+        loop_totals = array('i', [end - start for start, end in zip(starts, starts[1:])])
+
+    mesh_data = bpy.data.meshes.new(name)
+    mesh_data.vertices.add(len(coords) // 3)
+    mesh_data.vertices.foreach_set('co', coords)
+    mesh_data.loops.add(len(vertex_indices))
+    mesh_data.loops.foreach_set('vertex_index', vertex_indices)
+    mesh_data.polygons.add(len(loop_starts))
+    mesh_data.polygons.foreach_set('loop_start', loop_starts)
+    mesh_data.polygons.foreach_set('loop_total', loop_totals)
+    mesh_data.update(calc_edges=True)
+
+    if len(normals) == len(coords):
+        mesh_data.vertices.foreach_set('normal', normals)
+    elif len(normals):
+        for v, normal in zip(mesh_data.vertices, zip(normals[0::3], normals[1::3], normals[2::3])):
+            v.normal = normal
+
+    return mesh_data
+
+
+def select_only(objects, active=None):
+    """select objects, and nothing else, without operators"""
+    for obj in bpy.context.selected_objects:
+        obj.select_set(False)
+    for obj in objects:
+        obj.select_set(True)
+    if active is not None:
+        bpy.context.view_layer.objects.active = active
+
+
+def add_color_layer(mesh_data, name, color):
+    """new vertex color layer with the same RGBA color on every loop"""
+    try:
+        import numpy as np
+        HAS_NUMPY = True
+    except ImportError:
+        HAS_NUMPY = False
+
+    vcol_layer = mesh_data.vertex_colors.new(name=name)
+    loops_count = len(mesh_data.loops)
+    if HAS_NUMPY:
+        colors = np.tile(np.array(color, dtype=np.float32), loops_count)
+    else:
+        colors = array('f', color) * loops_count
+    vcol_layer.data.foreach_set('color', colors)
+    return vcol_layer
+
+
+def add_gray_layer(mesh_data, name, grays):
+    """new vertex color layer, loop i is painted with the gray level grays[i]"""
+    try:
+        import numpy as np
+        HAS_NUMPY = True
+    except ImportError:
+        HAS_NUMPY = False
+
+    vcol_layer = mesh_data.vertex_colors.new(name=name)
+    if HAS_NUMPY:
+        grays = np.asarray(grays, dtype=np.float32)
+        colors = np.ones((len(grays), 4), dtype=np.float32)
+        colors[:, :3] = grays[:, None]
+        colors = colors.ravel()
+    else:
+        colors = array('f')
+        for gray in grays:
+            colors.extend((gray, gray, gray, 1.0))
+    vcol_layer.data.foreach_set('color', colors)
+    return vcol_layer
+
+
+def add_shade_layer(mesh_data, shades):
+    """'shade' vertex color layer, each loop is as bright as the shade
+    (0..255) of its vertex
+
+    Loops are painted up to the first vertex without shade, the others are
+    left white (statics with dynamic lighting have no shades)."""
+    try:
+        import numpy as np
+        HAS_NUMPY = True
+    except ImportError:
+        HAS_NUMPY = False
+
+    loops_count = len(mesh_data.loops)
+    if HAS_NUMPY:
+        vertex_indices = np.empty(loops_count, dtype=np.int32)
+        mesh_data.loops.foreach_get('vertex_index', vertex_indices)
+        missing = np.flatnonzero(vertex_indices >= len(shades))
+        painted = missing[0] if len(missing) else loops_count
+
+        shades = np.asarray(shades, dtype=np.float32)
+        grays = np.ones(loops_count, dtype=np.float32)
+        grays[:painted] = shades[vertex_indices[:painted]] / 255
+    else:
+        vertex_indices = array('i', [0]) * loops_count
+        mesh_data.loops.foreach_get('vertex_index', vertex_indices)
+        grays = array('f', [1.0]) * loops_count
+        for loop_index, vertex_index in enumerate(vertex_indices):
+            if vertex_index >= len(shades):
+                break
+            grays[loop_index] = shades[vertex_index] / 255
+
+    return add_gray_layer(mesh_data, 'shade', grays)
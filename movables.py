@@ -1,18 +1,11 @@
-import math
-
 import bpy
+from mathutils import Vector
 
 from .objects import movables2discard
 from .create_materials import apply_textures, pack_textures
+from .mesh_builder import WAD_AXES, add_color_layer, build_mesh, select_only
 from .animations import create_animations, save_animations_data
-
-def paint_vertex(mesh):
-    vcol_layer = mesh.vertex_colors.new(name='shade')
-
-    for poly in mesh.polygons:
-        for loop_index in poly.loop_indices:
-            vcol_layer.data[loop_index].color = (0.5, 0.5, 0.5, 1.0)
-
+from .skeleton_builder import build_skeleton, create_bones
 
 def main(context, materials, wad, options):
     movable_objects = {}
@@ -26,6 +19,8 @@ def main(context, materials, wad, options):
     if 'Movables' not in main_collection.children:
         main_collection.children.link(col_movables)
 
+    created = []
+    skeletons = []
     for i, movable in enumerate(wad.movables):
         idx = str(movable.idx)
         if idx in options.mov_names:
@@ -48,13 +43,11 @@ def main(context, materials, wad, options):
         meshes = []
         meshes2 = []        
         for j, m in enumerate(movable.meshes):
-            verts = [[v / options.scale for v in e] for e in m.vertices]
-            faces = [e.face for e in m.polygons]
             shine = [e.shine for e in m.polygons]
             shineIntensity = [e.intensity for e in m.polygons]
             opacity = [e.opacity for e in m.polygons]
             mesh_name = name + '.' + str(j).zfill(3)
-            mesh_data = bpy.data.meshes.new(mesh_name)
+            mesh_data = build_mesh(mesh_name, m, options.scale, WAD_AXES)
             mesh_obj = bpy.data.objects.new(mesh_name, mesh_data)
             mesh_obj['boundingSphereCenter'] = [e / options.scale for e in m.boundingSphereCenter]
             mesh_obj['boundingSphereRadius'] = m.boundingSphereRadius / options.scale
@@ -65,10 +58,6 @@ def main(context, materials, wad, options):
 
             collection.objects.link(mesh_obj)
             bpy.context.view_layer.objects.active = mesh_obj
-            mesh_data.from_pydata(verts, [], faces)
-            if m.normals:
-                for v, normal in zip(mesh_data.vertices, m.normals):
-                    v.normal = normal
 
             if not options.one_material_per_object:
                 apply_textures(context, m, mesh_obj, materials, options)
@@ -76,7 +65,7 @@ def main(context, materials, wad, options):
                     mesh_data.flip_normals()
             else:
                 meshes2.append(m)
-            paint_vertex(mesh_data)
+            add_color_layer(mesh_data, 'shade', (0.5, 0.5, 0.5, 1.0))
             meshes.append(mesh_obj)
 
         if options.one_material_per_object:
@@ -89,68 +78,22 @@ def main(context, materials, wad, options):
         animations[name] = movable.animations
 
         meshnames = [m.name for m in meshes]
-        
-        parent = meshes[0].name
-        prev = parent
-        stack = [meshes[0].name] * 100
-        cpivot_points = {}
-        cpivot_points[meshes[0].name] = (0., 0., 0.)
-        parents = {}
-        if len(meshes) > 1:
-            for j in range(1, len(meshes)):
-                op, dx, dy, dz = movable.joints[j-1]
-                cur = meshnames[j]
-                if op == 0:
-                    parent = prev
-                elif op == 1:
-                    parent = stack.pop()
-                elif op == 2:
-                    parent = prev
-                    stack.append(parent)
-                else:
-                    parent = stack[-1]
-
-                parents[cur] = parent
-                px, py, pz = cpivot_points[parent]
-                s = options.scale
-                cpivot_points[cur] = (px + dx/s, py + dy / s, pz + dz / s)
-                mesh_obj = next(mesh for mesh in meshes if mesh.name == cur)
-                mesh_obj.location = cpivot_points[cur]
-                prev = cur
+        parents, pivot_points = build_skeleton(movable.joints, len(meshes), options.scale)
+        for mesh_obj, pivot_point in zip(meshes[1:], pivot_points[1:]):
+            mesh_obj.location = WAD_AXES @ Vector(pivot_point)
 
         amt = bpy.data.armatures.new(name)
         rig = bpy.data.objects.new(name + '_RIG', amt)
         collection.objects.link(rig)
-        bpy.context.view_layer.objects.active = rig
-
-        bpy.ops.object.mode_set(mode='EDIT')
-        for cur in meshnames:
-            if cur not in parents:
-                bone = amt.edit_bones.new(cur)
-                bone.head, bone.tail = (0., 0., 0.), (0., 100 / options.scale, 0.)
-                bone = None
-            else:
-                tail = [child for child, parent in parents.items() if parent == cur]
-                
-                if len(tail) > 0:
-                    bone = amt.edit_bones.new(cur)
-                    bone.head, bone.tail = cpivot_points[cur], cpivot_points[tail[0]]
-                    x, y, z = cpivot_points[cur]
-                    bone.head, bone.tail = cpivot_points[cur], (x, y + 100 / options.scale, z)
-                    bone.parent = amt.edit_bones[parents[cur]]
-                    if bone.head == bone.tail:
-                        bone.tail[1] += 0.001
-                    bone = None
-                else:
-                    bone = amt.edit_bones.new(cur)
-                    x, y, z = cpivot_points[cur]
-                    bone.head, bone.tail = cpivot_points[cur], (x, y + 100 / options.scale, z)
-                    bone.parent = amt.edit_bones[parents[cur]]
-                    bone = None
-
-        bone = None
-        bpy.ops.object.mode_set(mode="OBJECT")
+        created.append((name, idx, collection, meshes, rig))
+        skeletons.append((meshnames, parents, pivot_points))
 
+    # bones of all the movables are created in a single edit mode session
+    rigs = [rig for *_, rig in created]
+    create_bones(rigs, skeletons, options.scale, WAD_AXES)
+
+    for name, idx, collection, meshes, rig in created:
+        meshnames = [m.name for m in meshes]
         for i in range(len(meshes)):
             mesh = meshes[i]
             bonename = mesh.name
@@ -172,27 +115,15 @@ def main(context, materials, wad, options):
         if options.export_json:
             save_animations_data(idx, animations[name], name, options)
 
-        rig.rotation_euler[0] = -math.pi/2
-        rig.rotation_euler[2] = -math.pi
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-
         if options.export_fbx:
             filepath = options.path + '\\{}.fbx'.format(name)
-            bpy.ops.object.select_all(action='DESELECT')
-
-            bpy.context.view_layer.objects.active = rig
-            for obj in collection.objects:
-                obj.select_set(True)
+            select_only(collection.objects, rig)
             bpy.ops.export_scene.fbx(filepath=filepath, axis_forward='Z', use_selection=True, add_leaf_bones=False, bake_anim_use_all_actions =False)
 
 
         if options.export_obj:
             filepath = options.path + '\\{}.obj'.format(name)
-            bpy.ops.object.select_all(action='DESELECT')
-
-            bpy.context.view_layer.objects.active = rig
-            for obj in collection.objects:
-                obj.select_set(True)
+            select_only(collection.objects, rig)
             bpy.ops.export_scene.obj(filepath=filepath, axis_forward='Z', use_selection=True)
             
         if not options.single_object:
@@ -3,6 +3,7 @@ from bpy_extras.io_utils import ImportHelper, ExportHelper
 from bpy.props import StringProperty
 
 from .create_materials import generateNodesSetup
+from .mesh_builder import add_color_layer
 
 class WadBlenderAddShineVertexLayer(bpy.types.Operator):
     bl_idname = "wadblender.shine_load"
@@ -13,12 +14,7 @@ class WadBlenderAddShineVertexLayer(bpy.types.Operator):
         if context.active_object.type != 'MESH':
             return {'FINISHED'}
 
-        vcolor_layer = context.active_object.data.vertex_colors.new(name='shine')
-        v = 0
-        for poly in context.active_object.data.polygons:
-            for idx in poly.loop_indices:
-                vcolor_layer.data[v].color = (0, 0, 0, 1)
-                v += 1
+        add_color_layer(context.active_object.data, 'shine', (0, 0, 0, 1))
 
         return {'FINISHED'}
 
@@ -31,12 +27,7 @@ class WadBlenderAddOpacityVertexLayer(bpy.types.Operator):
         if context.active_object.type != 'MESH':
             return {'FINISHED'}
 
-        vcolor_layer = context.active_object.data.vertex_colors.new(name='opacity')
-        v = 0
-        for poly in context.active_object.data.polygons:
-            for idx in poly.loop_indices:
-                vcolor_layer.data[v].color = (0, 0, 0, 1)
-                v += 1
+        add_color_layer(context.active_object.data, 'opacity', (0, 0, 0, 1))
 
         return {'FINISHED'}
 
@@ -50,12 +41,7 @@ class WadBlenderAddShadeVertexLayer(bpy.types.Operator):
         if context.active_object.type != 'MESH':
             return {'FINISHED'}
 
-        v = 0
-        vcolor_layer = context.active_object.data.vertex_colors.new(name='shade')
-        for poly in context.active_object.data.polygons:
-            for idx in poly.loop_indices:
-                vcolor_layer.data[v].color = (0.5, 0.5, 0.5, 1)
-                v += 1
+        add_color_layer(context.active_object.data, 'shade', (0.5, 0.5, 0.5, 1))
         return {'FINISHED'}
 
 
@@ -21,81 +21,166 @@ movables2discard = {'LARA', 'PISTOLS_ANIM', 'UZI_ANIM', 'SHOTGUN_ANIM', 'CROSSBO
                     'CAMERA_TARGET', 'VEHICLE_EXTRA_MVB'}
 
 
+import hashlib
+import json
 import xml.etree.ElementTree as ET
-
-
-def get_partial_names(version):
-    cur_script_path = os.path.dirname(os.path.realpath(__file__))
-    filename = cur_script_path + '\\resources\\trcatalog.xml'
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    movables = {}
-    statics = {}
-    animations = {}
-    states = {}
-
-    for game in root:
-        if game.attrib['id'] != version:
-            continue
-
-        for g in game:
-            if g.tag == 'moveables':
-                for mov in g:
-                    movables[mov.attrib['id']] = mov.attrib['name']
-
-            if g.tag == 'statics':
-                for static in g:
-                    statics[static.attrib['id']] = static.attrib['name']
-
-            if g.tag == 'animations':
-                for anim in g:
-                    item_id = anim.attrib['item']
-
-                    if item_id not in animations:
-                        animations[item_id] = {}
-
-                    animations[item_id][anim.attrib['id']] = anim.attrib['name']
-
-            if g.tag == 'states':
-                for state in g:
-                    item_id = state.attrib['item']
-                    if item_id not in states:
-                        states[item_id] = {}
-                    states[item_id][state.attrib['id']] = state.attrib['name']
-
-    return movables, statics, animations, states
-
-
+from functools import lru_cache
+
+GAMES = ['TR1', 'TR2', 'TR3', 'TR4', 'TR5', 'TR5Main']
+
+resources_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'resources')
+catalog_path = os.path.join(resources_path, 'trcatalog.xml')
+
+
+@lru_cache(maxsize=1)
+def catalog_digest():
+    with open(catalog_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def compiled_catalog_path(game):
+    return os.path.join(resources_path, 'trcatalog_{}.json'.format(game))
+
+
+class Catalog:
+    """names of every game, read from trcatalog.xml in a single streaming
+    pass
+
+    The animations and states of older games are added to the movables of
+    each game, the oldest name of an id winning. Ids are ints, so lookups
+    need no str()."""
+
+    def __init__(self):
+        self.movables = {game: {} for game in GAMES}
+        self.statics = {game: {} for game in GAMES}
+        self.animations = {game: {} for game in GAMES}
+        self.states = {game: {} for game in GAMES}
+
+    @classmethod
+    def load(cls, path=catalog_path):
+        catalog = cls()
+        # animations and states of the games parsed so far
+        inherited = {}, {}
+
+        # attributes are complete at start events, so those are enough
+        game = None
+        for _, elem in ET.iterparse(path, events=('start',)):
+            tag = elem.tag
+            attrib = elem.attrib
+            if tag == 'game':
+                if game is not None:
+                    # the previous game has been read entirely
+                    catalog.inherit(game.attrib['id'], *inherited)
+                    game.clear()
+                game = elem
+                game_id = attrib['id']
+                if game_id not in catalog.movables:
+                    catalog.add_game(game_id)
+                movables = catalog.movables[game_id]
+                statics = catalog.statics[game_id]
+                animations = catalog.animations[game_id]
+                states = catalog.states[game_id]
+            elif game is None:
+                # names outside a game belong to none of them
+                continue
+            elif tag == 'moveable':
+                movables[int(attrib['id'])] = attrib['name']
+            elif tag == 'static':
+                statics[int(attrib['id'])] = attrib['name']
+            elif tag == 'anim':
+                item = animations.setdefault(int(attrib['item']), {})
+                item[int(attrib['id'])] = attrib['name']
+            elif tag == 'state':
+                item = states.setdefault(int(attrib['item']), {})
+                item[int(attrib['id'])] = attrib['name']
+
+        if game is not None:
+            catalog.inherit(game.attrib['id'], *inherited)
+
+        return catalog
+
+    def inherit(self, game, inherited_animations, inherited_states):
+        """add the names of older games to the movables of game"""
+        movables = self.movables[game]
+        for own, inherited in ((self.animations[game], inherited_animations),
+                               (self.states[game], inherited_states)):
+            for item, names in inherited.items():
+                if item in movables:
+                    merged = own.setdefault(item, {})
+                    for idx, name in names.items():
+                        merged.setdefault(idx, name)
+            # the names merged above are already in inherited, so only the
+            # ones of this game are new for newer games
+            for item, names in own.items():
+                older = inherited.setdefault(item, {})
+                for idx, name in names.items():
+                    older.setdefault(idx, name)
+
+    def add_game(self, game):
+        self.movables[game] = {}
+        self.statics[game] = {}
+        self.animations[game] = {}
+        self.states[game] = {}
+
+    def movable_name(self, game, idx):
+        return self.movables[game].get(idx)
+
+    def static_name(self, game, idx):
+        return self.statics[game].get(idx)
+
+    def animation_name(self, game, item, idx):
+        return self.animations[game].get(item, {}).get(idx)
+
+    def state_name(self, game, item, idx):
+        return self.states[game].get(item, {}).get(idx)
+
+    def names(self, game):
+        """str keyed (movables, statics, animations, states) tables of a
+        game, as stored in the compiled catalog"""
+        def str_keys(table):
+            return {str(k): v for k, v in table.items()}
+
+        return (str_keys(self.movables[game]),
+                str_keys(self.statics[game]),
+                {str(item): str_keys(t) for item, t in self.animations[game].items()},
+                {str(item): str_keys(t) for item, t in self.states[game].items()})
+
+
+@lru_cache(maxsize=1)
+def compile_catalog():
+    """parse trcatalog.xml once and save the names of every game in a
+    json file, tagged with the hash of the xml it was built from
+
+    The result is kept, so the xml is parsed once per session even when
+    the json files cannot be written."""
+    loaded = Catalog.load()
+    catalog = {}
+    for game in GAMES:
+        catalog[game] = loaded.names(game)
+        compiled = {'source': catalog_digest(), 'names': catalog[game]}
+        try:
+            with open(compiled_catalog_path(game), 'w') as f:
+                json.dump(compiled, f)
+        except OSError:
+            # read-only addon folder, the xml will be parsed again next time
+            pass
+
+    return catalog
+
+
+@lru_cache(maxsize=None)
 def get_names(ver):
-    movables, statics, animations, states = get_partial_names(ver)
-
-    for g in ['TR1', 'TR2', 'TR3', 'TR4', 'TR5', 'TR5Main']:
-        if g == ver:
-            break
-
-        _, _, animations2, states2 = get_partial_names(g)
-
-        for item, obj in animations2.items():
-            if item in movables and item not in animations:
-                animations[item] = {}
-                for id, name in obj.items():
-                    animations[item][id] = name
-            elif item in movables and item in animations:
-                for id, name in obj.items():
-                    if id not in animations[item]:
-                        animations[item][id] = name
-
-
-        for item, obj in states2.items():
-            if item in movables and item not in states:
-                states[item] = {}
-                for id, name in obj.items():
-                    states[item][id] = name
-            elif item in movables and item in states2:
-                for id, name in obj.items():
-                    if id not in states[item]:
-                        states[item][id] = name
-
-
-    return movables, statics, animations, states
\ No newline at end of file
+    """names of a game from its compiled catalog, which is rebuilt when
+    trcatalog.xml changes
+
+    The tables are shared by all the callers, copy them before changing
+    them."""
+    try:
+        with open(compiled_catalog_path(ver)) as f:
+            compiled = json.load(f)
+        if compiled['source'] == catalog_digest():
+            return tuple(compiled['names'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return compile_catalog()[ver]
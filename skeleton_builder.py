@@ -0,0 +1,60 @@
+import bpy
+
+from .mesh_builder import select_only
+
+
+def build_skeleton(joints, count, scale):
+    """parent index (None for the root) and pivot point of each of the
+    count meshes of a movable, from its joints"""
+    parents = [None] * count
+    pivot_points = [(0., 0., 0.)] * count
+    prev = 0
+    stack = [0] * 100
+    for j in range(1, count):
+        op, dx, dy, dz = joints[j - 1]
+        if op == 0:
+            parent = prev
+        elif op == 1:
+            parent = stack.pop()
+        elif op == 2:
+            parent = prev
+            stack.append(parent)
+        else:
+            parent = stack[-1]
+
+        parents[j] = parent
+        px, py, pz = pivot_points[parent]
+        pivot_points[j] = (px + dx / scale, py + dy / scale, pz + dz / scale)
+        prev = j
+
+    return parents, pivot_points
+
+
+def create_bones(rigs, skeletons, scale, matrix=None):
+    """create the bones of every rig in a single edit mode session
+
+    skeletons holds the (bone names, parents, pivot points) of each rig,
+    bones point up from their pivot point and are then rotated by matrix."""
+    if not rigs:
+        return
+
+    # the selected armatures are edited together
+    select_only(rigs, rigs[0])
+
+    bpy.ops.object.mode_set(mode='EDIT')
+    for rig, (names, parents, pivot_points) in zip(rigs, skeletons):
+        edit_bones = rig.data.edit_bones
+        bones = []
+        for name, parent, (x, y, z) in zip(names, parents, pivot_points):
+            bone = edit_bones.new(name)
+            bone.head, bone.tail = (x, y, z), (x, y + 100 / scale, z)
+            if parent is not None:
+                bone.parent = bones[parent]
+            bones.append(bone)
+        if matrix is not None:
+            for bone in bones:
+                bone.transform(matrix)
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    for rig in rigs:
+        rig.select_set(False)
@@ -1,6 +1,7 @@
 # this is mostly from sprytile source code.
 # used to write metadata into bmeshes
 import bpy
+import bmesh
 
 
 def check_install():
@@ -102,40 +103,63 @@ def get_grid(context, grid_id):
     return None
 
 
-def write_metadata(context, obj, face_index, mesh, width, height, tile_x, tile_y, flipx, flipy, map_width=256):
-    grid_layer_id = mesh.faces.layers.int.get(UvDataLayers.GRID_INDEX)
-    grid_layer_tileid = mesh.faces.layers.int.get(UvDataLayers.GRID_TILE_ID)
-    grid_sel_width = mesh.faces.layers.int.get(UvDataLayers.GRID_SEL_WIDTH)
-    grid_sel_height = mesh.faces.layers.int.get(UvDataLayers.GRID_SEL_HEIGHT)
-    grid_sel_origin = mesh.faces.layers.int.get(UvDataLayers.GRID_SEL_ORIGIN)
-    paint_settings_id = mesh.faces.layers.int.get(UvDataLayers.PAINT_SETTINGS)
-    work_layer_id = mesh.faces.layers.int.get(UvDataLayers.WORK_LAYER)
+def material_grids(context):
+    """id of the first grid of each material, the last sprytile entry of a
+    material wins"""
+    grid_ids = {}
+    for mat_data in context.scene.sprytile_mats:
+        for grid in mat_data.grids:
+            grid_ids[mat_data.mat_id] = grid.id
+            break
+    return grid_ids
+
 
-    face = mesh.faces[face_index]
-    tile_id = (tile_y * map_width) + tile_x
+def write_metadata(context, obj, faces, map_width=256, grid_ids=None):
+    """write the sprytile data of the faces of obj, in a single bmesh pass
 
+    faces holds (width, height, tile_x, tile_y, flipx, flipy) for each face
+    of the mesh, faces without a sprytile grid are left unchanged. grid_ids
+    is the result of material_grids, computed when not given."""
     data = context.scene.sprytile_data
-    paint_settings = get_paint_settings(data, flipx, flipy, 0)
     work_layer_data = get_work_layer_data(data)
+    paint_settings = {(flipx, flipy): get_paint_settings(data, flipx, flipy, 0)
+                      for flipx in (False, True) for flipy in (False, True)}
+
+    if grid_ids is None:
+        grid_ids = material_grids(context)
+    slot_grids = [grid_ids.get(slot.material.name) if slot.material else None
+                  for slot in obj.material_slots]
+
+    bm = bmesh.new()
+    bm.from_mesh(obj.data)
+    verify_bmesh_layers(bm)
+    layers = bm.faces.layers.int
+    grid_layer_id = layers.get(UvDataLayers.GRID_INDEX)
+    grid_layer_tileid = layers.get(UvDataLayers.GRID_TILE_ID)
+    grid_sel_width = layers.get(UvDataLayers.GRID_SEL_WIDTH)
+    grid_sel_height = layers.get(UvDataLayers.GRID_SEL_HEIGHT)
+    grid_sel_origin = layers.get(UvDataLayers.GRID_SEL_ORIGIN)
+    paint_settings_id = layers.get(UvDataLayers.PAINT_SETTINGS)
+    work_layer_id = layers.get(UvDataLayers.WORK_LAYER)
+
+    for face, (width, height, tile_x, tile_y, flipx, flipy) in zip(bm.faces, faces):
+        if face.material_index >= len(slot_grids):
+            continue
+        grid_id = slot_grids[face.material_index]
+        if grid_id is None:
+            continue
 
-    mat = obj.material_slots[face.material_index].material
-
-    mat_list = context.scene.sprytile_mats
-    for mat_data in mat_list:
-        if mat_data.mat_id == mat.name:
-            for grid in mat_data.grids:
-                face[grid_layer_id] = grid.id
-                face[grid_layer_tileid] = tile_id
-                face[grid_sel_width] = width
-                face[grid_sel_height] = height
-                face[grid_sel_origin] = tile_id
-                face[paint_settings_id] = paint_settings
-                face[work_layer_id] = work_layer_data
-                break
-
-    mesh.to_mesh(obj.data)
-    mesh.faces.index_update()
+        tile_id = (tile_y * map_width) + tile_x
+        face[grid_layer_id] = grid_id
+        face[grid_layer_tileid] = tile_id
+        face[grid_sel_width] = width
+        face[grid_sel_height] = height
+        face[grid_sel_origin] = tile_id
+        face[paint_settings_id] = paint_settings[bool(flipx), bool(flipy)]
+        face[work_layer_id] = work_layer_data
 
+    bm.to_mesh(obj.data)
+    bm.free()
 
 
 def get_material_texture_node(mat):
@@ -231,20 +255,19 @@ def validate_grids(context):
 
     # Loop through available materials, checking if mat_data_list has
     # at least one entry for each material
+    valid_mat_ids = {mat_data.mat_id for mat_data in mat_data_list}
+    highest_id = get_highest_grid_id(context)
     for mat in mat_list:
         if mat.users == 0:
             continue
-        is_mat_valid = False
-        for mat_data in mat_data_list:
-            if mat_data.mat_id == mat.name:
-                is_mat_valid = True
-                break
-        if is_mat_valid is False and mat.name != "Dots Stroke":
+        if mat.name not in valid_mat_ids and mat.name != "Dots Stroke":
+            valid_mat_ids.add(mat.name)
             mat_data_entry = mat_data_list.add()
             mat_data_entry.mat_id = mat.name
             mat_grid = mat_data_entry.grids.add()
             mat_grid.mat_id = mat.name
-            mat_grid.id = get_highest_grid_id(context) + 1
+            highest_id += 1
+            mat_grid.id = highest_id
 
             mat_grid.grid = (1, 1)
             addon_prefs = bpy.context.preferences.addons['SpryTile'].preferences
@@ -255,24 +278,83 @@ def validate_grids(context):
     bpy.ops.sprytile.build_grid_list()
 
 
-def assign_material(context, obj, material, sprytile_installed):
+def assign_material(context, obj, material, deferred=None):
+    """append material to obj, deferred is the DeferredSetup of the import
+    (None when sprytile is not installed)"""
     obj.data.materials.append(material)
     bpy.context.view_layer.objects.active = obj
 
-    if sprytile_installed:
-        validate_grids(context)
-        bpy.data.materials.update()
+    if deferred is not None:
+        deferred.add_material(material, obj)
 
-        bpy.ops.sprytile.texture_setup('INVOKE_DEFAULT')
-        validate_grids(context)
-        bpy.data.textures.update()
 
-        addon_prefs = context.preferences.addons['SpryTile'].preferences
-        if addon_prefs:
-            if addon_prefs.auto_pixel_viewport:
-                bpy.ops.sprytile.viewport_setup('INVOKE_DEFAULT')
-            if addon_prefs.auto_grid_setup:
-                bpy.ops.sprytile.setup_grid('INVOKE_DEFAULT')
+def exists(obj):
+    """False once obj has been removed from bpy.data"""
+    try:
+        return bpy.data.objects.get(obj.name) == obj
+    except ReferenceError:
+        return False
+
+
+class DeferredSetup:
+    """sprytile setup of an import, done once by finish()
+
+    Validating the grids and running the sprytile operators for each new
+    material is slow, so the importer only registers the materials and
+    the face metadata of the objects it creates. finish() validates the
+    grids once, sets up the materials that need it, then writes the
+    metadata. Objects removed in the meantime are skipped."""
+
+    def __init__(self):
+        self.materials = []
+        self.objects = []
+        self.metadata = []
+
+    def add_material(self, material, obj=None):
+        if material not in self.materials:
+            self.materials.append(material)
+        if obj is not None:
+            self.objects.append(obj)
+
+    def add_metadata(self, obj, faces, map_width=256):
+        self.metadata.append((obj, faces, map_width))
+        self.objects.append(obj)
+
+    def finish(self, context):
+        objects = [obj for obj in self.objects if exists(obj)]
+        if objects:
+            view_layer = bpy.context.view_layer
+            active = view_layer.objects.active
+            # validate_grids and the sprytile operators work on the active
+            # object, which may have been removed by the importer
+            view_layer.objects.active = objects[0]
+            validate_grids(context)
+            bpy.data.materials.update()
+
+            grid_ids = material_grids(context)
+            for material in self.materials:
+                if material.name not in grid_ids:
+                    continue
+                for obj in objects:
+                    slots = [slot.material for slot in obj.material_slots]
+                    if material in slots:
+                        obj.active_material_index = slots.index(material)
+                        setup_material(context, obj, material, grid_ids[material.name])
+                        break
+
+            bpy.data.textures.update()
+            setup_viewport(context)
+
+            for obj, faces, map_width in self.metadata:
+                if exists(obj):
+                    write_metadata(context, obj, faces, map_width, grid_ids)
+
+            if active is not None and exists(active):
+                view_layer.objects.active = active
+
+        self.materials.clear()
+        self.objects.clear()
+        self.metadata.clear()
 
 
 def verify_bmesh_layers(bm):
@@ -282,21 +364,36 @@ def verify_bmesh_layers(bm):
         if layer_data is None:
             bm.faces.layers.int.new(layer_name)
 
-        for el in [bm.faces, bm.verts, bm.edges]:
-            el.index_update()
-            el.ensure_lookup_table()
+    for el in [bm.faces, bm.verts, bm.edges]:
+        el.index_update()
+        el.ensure_lookup_table()
+
+    bm.loops.layers.uv.verify()
 
-        bm.loops.layers.uv.verify()
 
+def setup_material(context, obj, material, grid_id):
+    """run the sprytile operators a new material needs, on obj which uses
+    it as active material
+
+    The texture of the materials built by generateNodesSetup is already
+    set up, only the grid may still be sized to the texture."""
+    node = get_material_texture_node(material)
+    texture_ready = node is not None and node.interpolation == 'Closest'
+    addon_prefs = context.preferences.addons['SpryTile'].preferences
+    grid_setup = addon_prefs and addon_prefs.auto_grid_setup
+    if texture_ready and not grid_setup:
+        return
+
+    # the operators work on the grid of the active object
+    bpy.context.view_layer.objects.active = obj
+    obj.sprytile_gridid = grid_id
+    if not texture_ready:
+        bpy.ops.sprytile.texture_setup('INVOKE_DEFAULT')
+    if grid_setup:
+        bpy.ops.sprytile.setup_grid('INVOKE_DEFAULT')
 
-def update(context):
-    bpy.ops.sprytile.texture_setup('INVOKE_DEFAULT')
-    validate_grids(context)
-    bpy.data.textures.update()
 
+def setup_viewport(context):
     addon_prefs = context.preferences.addons['SpryTile'].preferences
-    if addon_prefs:
-        if addon_prefs.auto_pixel_viewport:
-            bpy.ops.sprytile.viewport_setup('INVOKE_DEFAULT')
-        if addon_prefs.auto_grid_setup:
-            bpy.ops.sprytile.setup_grid('INVOKE_DEFAULT')
\ No newline at end of file
+    if addon_prefs and addon_prefs.auto_pixel_viewport:
+        bpy.ops.sprytile.viewport_setup('INVOKE_DEFAULT')
@@ -1,23 +1,7 @@
 import bpy
-import math
 
 from .create_materials import apply_textures, pack_textures
-
-
-def paint_vertex(obj):
-    mesh = obj.data
-
-    vcol_layer = mesh.vertex_colors.new(name='shade')
-
-
-    for poly in mesh.polygons:
-        for loop_index in poly.loop_indices:
-            loop_vert_index = mesh.loops[loop_index].vertex_index
-            if loop_vert_index >= len(obj['shades']):
-                # static has dynamic lighting info
-                return
-            shade = 1 - obj['shades'][loop_vert_index] / 255
-            vcol_layer.data[loop_index].color = [1 - shade, ] * 3 + [1.0]
+from .mesh_builder import WAD_AXES, add_shade_layer, build_mesh, select_only
 
 
 def main(context, materials, wad, options):
@@ -41,38 +25,30 @@ def main(context, materials, wad, options):
             continue
 
         m = static.mesh
-        verts = [[v/options.scale for v in e] for e in m.vertices]
-        faces = [e.face for e in m.polygons]
-        mesh = bpy.data.meshes.new(name)
+        mesh = build_mesh(name, m, options.scale, WAD_AXES)
         obj = bpy.data.objects.new(name, mesh)
         obj['shades'] = m.shades
         col.objects.link(obj)
         bpy.context.view_layer.objects.active = obj
-        mesh.from_pydata(verts, [], faces)
         if options.one_material_per_object:
             pack_textures(context, [m], [obj], options, name)
         else:
             apply_textures(context, m, obj, materials, options, name)
         if options.flip_normals:
             mesh.flip_normals()
-        paint_vertex(obj)
+        add_shade_layer(mesh, m.shades)
 
-        bpy.context.object.select_set(True)
-        bpy.context.object.rotation_euler[0] = -math.pi/2
-        bpy.context.object.rotation_euler[2] = -math.pi
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
+        obj.select_set(True)
 
         if options.export_fbx:
-            bpy.ops.object.select_all(action='DESELECT')
-            bpy.context.object.select_set(True)
+            select_only([obj], obj)
             filepath = options.path + '\\{}.fbx'.format(name)
             bpy.ops.export_scene.fbx(filepath=filepath, axis_forward='Z',
                                      use_selection=True, add_leaf_bones=False,
                                      bake_anim_use_all_actions=False)
 
         if options.export_obj:
-            bpy.ops.object.select_all(action='DESELECT')
-            bpy.context.object.select_set(True)
+            select_only([obj], obj)
             filepath = options.path + '\\{}.obj'.format(name)
             bpy.ops.export_scene.obj(filepath=filepath, axis_forward='Z',
                                      use_selection=True)
@@ -0,0 +1,102 @@
+"""Inspect WAD files without Blender
+
+usage: python -m wad COMMAND [options] PATH [PATH ...]
+
+PATH is a WAD file or a folder, whose .wad files are all processed. The
+exit status is 1 if any of them could not be read."""
+import argparse
+import json
+import os
+import sys
+
+from . import batch
+
+
+def wad_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith('.wad'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def load_names(game):
+    """slot names of a game, from objects.py in the addon folder"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import objects
+    return objects.get_names(game)
+
+
+def print_rows(rows):
+    if not rows:
+        return
+
+    keys = list(rows[0])
+    cells = [[str(row.get(k, '')) for k in keys] for row in rows]
+    widths = [max(len(k), *(len(c[i]) for c in cells)) for i, k in enumerate(keys)]
+    print('  '.join(k.ljust(w) for k, w in zip(keys, widths)))
+    for c in cells:
+        print('  '.join(v.ljust(w) for v, w in zip(c, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m wad', description=__doc__.split('\n')[0])
+    parser.add_argument('command', choices=batch.COMMANDS)
+    parser.add_argument('paths', nargs='+', metavar='PATH')
+    parser.add_argument('--json', action='store_true', help='print json lines')
+    parser.add_argument('--game', help='slot names of TR1, TR2, TR3, TR4, TR5 or TR5Main')
+    parser.add_argument('--pages', action='store_true',
+                        help='save 256x256 texture pages instead of the full map')
+    parser.add_argument('-o', '--output', help='folder of the saved textures')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='worker processes, one per core by default')
+    parser.add_argument('--cache-dir', help='folder of the parsed WADs cache')
+    args = parser.parse_args(argv)
+
+    names = load_names(args.game) if args.game else None
+
+    failed = 0
+    all_stats = []
+    for path, result, error in batch.run(
+            wad_paths(args.paths), args.command, args.jobs, names=names,
+            pages=args.pages, output=args.output, cache_dir=args.cache_dir):
+        if error is not None:
+            failed += 1
+            if args.json:
+                print(json.dumps({'path': path, 'error': error}))
+            else:
+                print('{}: error: {}'.format(path, error), file=sys.stderr)
+            continue
+
+        if args.json:
+            print(json.dumps({'path': path, args.command: result}))
+        elif args.command == 'stats':
+            print(path)
+            for key, value in result.items():
+                print('  {}: {}'.format(key, value))
+        elif args.command == 'textures':
+            for filename in result:
+                print(filename)
+        else:
+            print(path)
+            print_rows(result)
+
+        if args.command == 'stats':
+            all_stats.append(result)
+
+    if len(all_stats) > 1:
+        total = batch.merge_stats(all_stats)
+        if args.json:
+            print(json.dumps({'total': total}))
+        else:
+            print('total')
+            for key, value in total.items():
+                print('  {}: {}'.format(key, value))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
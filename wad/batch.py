@@ -0,0 +1,205 @@
+"""Run the python -m wad commands on many WADs in worker processes
+
+Workers parse the WADs and send back small json-like results (or write
+the extracted textures themselves), the main process only collects them."""
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from . import cache
+from . import model
+from . import read
+
+COMMANDS = ('stats', 'objects', 'animations', 'textures')
+
+
+def mesh_counts(mesh):
+    """(vertices, polygons) of a model.Mesh or model.ArrayMesh"""
+    if isinstance(mesh, model.ArrayMesh):
+        return len(mesh.coords) // 3, len(mesh.pages)
+    return len(mesh.vertices), len(mesh.polygons)
+
+
+def stats(wad):
+    meshes = {}
+    for static in wad.statics:
+        meshes[id(static.mesh)] = static.mesh
+    for movable in wad.movables:
+        for mesh in movable.meshes:
+            meshes[id(mesh)] = mesh
+
+    counts = [mesh_counts(mesh) for mesh in meshes.values()]
+    animations = [a for movable in wad.movables for a in movable.animations]
+    return {
+        'version': wad.version,
+        'movables': len(wad.movables),
+        'statics': len(wad.statics),
+        'meshes': len(meshes),
+        'vertices': sum(vertices for vertices, _ in counts),
+        'polygons': sum(polygons for _, polygons in counts),
+        'animations': len(animations),
+        'keyframes': sum(len(a.keyFrames) for a in animations),
+        'texture_map': [wad.mapwidth, wad.mapheight],
+        'texture_pages': wad.mapheight // 256,
+    }
+
+
+def objects_list(wad, names):
+    mov_names, static_names = names[:2] if names else ({}, {})
+    objects = []
+    for movable in wad.movables:
+        counts = [mesh_counts(mesh) for mesh in movable.meshes]
+        vertices = sum(vertices for vertices, _ in counts)
+        polygons = sum(polygons for _, polygons in counts)
+        objects.append({
+            'type': 'movable',
+            'idx': movable.idx,
+            'name': mov_names.get(str(movable.idx), 'MOVABLE{}'.format(movable.idx)),
+            'meshes': len(movable.meshes),
+            'vertices': vertices,
+            'polygons': polygons,
+            'animations': len(movable.animations),
+        })
+
+    for static in wad.statics:
+        vertices, polygons = mesh_counts(static.mesh)
+        objects.append({
+            'type': 'static',
+            'idx': static.idx,
+            'name': static_names.get(str(static.idx), 'STATIC{}'.format(static.idx)),
+            'meshes': 1,
+            'vertices': vertices,
+            'polygons': polygons,
+        })
+
+    return objects
+
+
+def animations_table(wad, names):
+    anim_names = names[2] if names else {}
+    table = []
+    for movable in wad.movables:
+        item_names = anim_names.get(str(movable.idx), {})
+        for idx, a in enumerate(movable.animations):
+            table.append({
+                'movable': movable.idx,
+                'idx': idx,
+                'name': item_names.get(str(idx), ''),
+                'state': a.stateID,
+                'keyframes': len(a.keyFrames),
+                'frame_duration': a.frameDuration,
+                'frames': [a.frameStart, a.frameEnd],
+                'next_animation': a.nextAnimation,
+                'frame_in': a.frameIn,
+                'speed': a.speed,
+                'acceleration': a.acceleration,
+                'state_changes': len(a.stateChanges),
+                'commands': len(a.commands),
+            })
+
+    return table
+
+
+def write_png(path, pixels, width, height):
+    """save RGBA uint8 pixels, bottom row first as in model.Wad"""
+    raw = pixels.tobytes() if hasattr(pixels, 'tobytes') else bytes(pixels)
+    stride = width * 4
+    rows = b''.join(b'\0' + raw[r * stride:(r + 1) * stride]
+                    for r in reversed(range(height)))
+
+    def chunk(tag, content):
+        crc = zlib.crc32(tag + content)
+        return struct.pack('>I', len(content)) + tag + content + struct.pack('>I', crc)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>2I5B', width, height, 8, 6, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows)))
+        f.write(chunk(b'IEND', b''))
+
+
+def textures(wad, path, pages=False, output=None):
+    """save the texture map, or its pages, next to path or in output"""
+    out_dir = output or os.path.dirname(path)
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    if pages:
+        images = [('{}_PAGE{}.png'.format(name, i), page, 256, 256)
+                  for i, page in enumerate(wad.textureMaps)]
+    else:
+        images = [(name + '.png', wad.textureMap, wad.mapwidth, wad.mapheight)]
+
+    written = []
+    for filename, pixels, w, h in images:
+        write_png(os.path.join(out_dir, filename), pixels, w, h)
+        written.append(filename)
+
+    return written
+
+
+def process(path, command, names=None, pages=False, output=None,
+            cache_dir=None):
+    """result of command for the WAD at path
+
+    If cache_dir is set, WADs are read through the on-disk cache (see
+    cache.readWAD), so that the next runs only load their arrays."""
+    options = SimpleNamespace(texture_pages=pages)
+    with open(path, 'rb') as f:
+        if command == 'textures':
+            wad = read.readWAD(f, options, lazy=True)
+        elif cache_dir:
+            wad = cache.readWAD(f, options, cache_dir)
+        else:
+            wad = read.readWAD(f, options, compact=True)
+
+    try:
+        if command == 'stats':
+            return stats(wad)
+        elif command == 'objects':
+            return objects_list(wad, names)
+        elif command == 'animations':
+            return animations_table(wad, names)
+        return textures(wad, path, pages, output)
+    finally:
+        wad.close()
+
+
+def try_process(path, command, **kwargs):
+    """(result, None) or (None, error message), exceptions raised in a
+    worker may not be picklable"""
+    try:
+        return process(path, command, **kwargs), None
+    except Exception as e:
+        return None, repr(e)
+
+
+def run(paths, command, jobs=None, **kwargs):
+    """yield (path, result, error) for each path, in order
+
+    WADs are processed by jobs worker processes (one per core by default),
+    or in this process if jobs is 1. kwargs are passed to process."""
+    paths = list(paths)
+    if jobs == 1 or len(paths) <= 1:
+        for path in paths:
+            yield (path, *try_process(path, command, **kwargs))
+        return
+
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(try_process, path, command, **kwargs)
+                   for path in paths]
+        for path, future in zip(paths, futures):
+            yield (path, *future.result())
+
+
+def merge_stats(results):
+    """sum of the stats of many WADs"""
+    total = {}
+    for result in results:
+        for key, value in result.items():
+            if isinstance(value, int) and key != 'version':
+                total[key] = total.get(key, 0) + value
+
+    total['wads'] = len(results)
+    return total
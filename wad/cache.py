@@ -0,0 +1,334 @@
+"""Persistent on-disk cache of parsed WAD files
+
+Each entry is an npz archive holding the arrays of a model.Wad, whose
+meshes are model.ArrayMesh. Entries are named after the hash of the WAD
+content, the texture mode and the sources of the parser, model and cache,
+so that they are not reused once one of them changes. Archives are loaded
+without pickle, opening a shared cache folder cannot run code.
+
+index.json maps the path of each WAD read to its size, modification time
+and content hash, so that unchanged files are not hashed again. Entries
+modification time is refreshed when they are used, and the least recently
+used ones are deleted once the cache grows beyond max_size bytes.
+
+The cache requires numpy, WADs are always parsed without it."""
+import gc
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from array import array
+from functools import lru_cache
+from itertools import islice
+
+from . import data
+from . import model
+from . import read
+
+CACHE_VERSION = 3
+
+# modules whose changes make old entries stale
+SOURCES = (data, model, read)
+
+MAX_SIZE = 2 * 1024 ** 3
+
+INDEX_NAME = 'index.json'
+
+MESH_ARRAYS = ('coords', 'normal_coords', 'shade_values', 'face_starts',
+               'face_indices', 'uv_rects', 'texture_rects', 'pages',
+               'attributes')
+
+ANIMATION_FIELDS = ('stateID', 'frameDuration', 'speed', 'acceleration',
+                    'frameStart', 'frameEnd', 'frameIn', 'nextAnimation')
+
+
+@lru_cache(maxsize=1)
+def sources_digest():
+    h = hashlib.blake2b(digest_size=4)
+    for path in [module.__file__ for module in SOURCES] + [__file__]:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def content_digest(content):
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def entry_name(digest, options):
+    mode = 'pages' if options.texture_pages else 'map'
+    return 'wad{}_{}_{}_{}.npz'.format(CACHE_VERSION, sources_digest(), digest, mode)
+
+
+def file_key(f):
+    """(path, size, modification time) of an open file, None for the
+    other buffers"""
+    path = getattr(f, 'name', None)
+    if not isinstance(path, str):
+        return None
+    try:
+        stat = os.fstat(f.fileno())
+    except OSError:
+        return None
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def load_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(index, dict):
+        return {}
+    # path -> [size, modification time, content digest]
+    return {path: key for path, key in index.items()
+            if isinstance(key, list) and len(key) == 3}
+
+
+def write_atomic(path, write):
+    """write(f) to a temporary file, then move it to path"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def store_index(cache_dir, index):
+    write_atomic(os.path.join(cache_dir, INDEX_NAME),
+                 lambda f: f.write(json.dumps(index).encode()))
+
+
+def ints(rows, width=None):
+    np = data.np
+    values = np.array(rows, dtype=np.int64)
+    return values if width is None else values.reshape(-1, width)
+
+
+def flatten(rows):
+    """flat values and lengths of int sequences of any length"""
+    rows = list(rows)
+    return (ints([value for row in rows for value in row]),
+            ints([len(row) for row in rows]))
+
+
+def unflatten(values, lengths):
+    values = values.tolist()
+    rows = []
+    start = 0
+    for length in lengths.tolist():
+        rows.append(values[start:start + length])
+        start += length
+    return rows
+
+
+def pack(wad):
+    """arrays of a model.Wad whose meshes are model.ArrayMesh"""
+    np = data.np
+
+    # meshes are shared by the objects, each one is stored once
+    meshes = []
+    mesh_indices = {}
+
+    def mesh_index(mesh):
+        if id(mesh) not in mesh_indices:
+            mesh_indices[id(mesh)] = len(meshes)
+            meshes.append(mesh)
+        return mesh_indices[id(mesh)]
+
+    statics = [(static.idx, mesh_index(static.mesh)) for static in wad.statics]
+    movables = wad.movables
+    movable_meshes = [mesh_index(mesh) for movable in movables
+                      for mesh in movable.meshes]
+    animations = [animation for movable in movables
+                  for animation in movable.animations]
+    keyframes = [keyframe for animation in animations
+                 for keyframe in animation.keyFrames]
+    state_changes = [(state, len(dispatches)) for animation in animations
+                     for state, dispatches in animation.stateChanges.items()]
+    dispatches = [dispatch for animation in animations
+                  for dispatches in animation.stateChanges.values()
+                  for dispatch in dispatches]
+
+    arrays = {
+        'header': ints([wad.version, wad.mapwidth, wad.mapheight]),
+        'texture_map': np.asarray(wad.textureMap, dtype=np.uint8),
+        'texture_pages': np.array(wad.textureMaps, dtype=np.uint8).reshape(-1, 256, 256, 4),
+        'statics': ints(statics, 2),
+        'movables': ints([(movable.idx, len(movable.meshes), len(movable.joints),
+                           len(movable.animations)) for movable in movables], 4),
+        'movable_meshes': ints(movable_meshes),
+        'animations': ints([[getattr(animation, field) for field in ANIMATION_FIELDS] +
+                            [len(animation.keyFrames), len(animation.stateChanges),
+                             len(animation.commands)] for animation in animations],
+                           len(ANIMATION_FIELDS) + 3),
+        'state_changes': ints(state_changes, 2),
+        'dispatches': ints(dispatches, 4),
+        'keyframes': ints([keyframe.offset + keyframe.bb1 + keyframe.bb2
+                           for keyframe in keyframes], 9),
+        'rotation_counts': ints([len(keyframe.rotations) for keyframe in keyframes]),
+        'rotations': np.array([rotation for keyframe in keyframes
+                               for rotation in keyframe.rotations],
+                              dtype=np.float64).reshape(-1, 3),
+        'mesh_spheres': ints([tuple(mesh.boundingSphereCenter) + (mesh.boundingSphereRadius,)
+                              for mesh in meshes], 4),
+    }
+    arrays['joints'], arrays['joint_lengths'] = flatten(
+        joint for movable in movables for joint in movable.joints)
+    arrays['commands'], arrays['command_lengths'] = flatten(
+        command for animation in animations for command in animation.commands)
+
+    empty = model.ArrayMesh(None, None)
+    for name in MESH_ARRAYS:
+        values = [getattr(mesh, name) for mesh in meshes]
+        code = getattr(empty, name).typecode
+        arrays[name] = np.frombuffer(b''.join(v.tobytes() for v in values), dtype=code)
+        arrays[name + '_counts'] = ints([len(v) for v in values])
+
+    return arrays
+
+
+def unpack(arrays):
+    """model.Wad of the arrays returned by pack"""
+    version, mapwidth, mapheight = arrays['header'].tolist()
+
+    meshes = [model.ArrayMesh(model.Point(x, y, z), radius)
+              for x, y, z, radius in arrays['mesh_spheres'].tolist()]
+    for name in MESH_ARRAYS:
+        values = arrays[name]
+        buffer = values.tobytes()
+        start = 0
+        for mesh, count in zip(meshes, arrays[name + '_counts'].tolist()):
+            end = start + count * values.itemsize
+            setattr(mesh, name, array(getattr(mesh, name).typecode, buffer[start:end]))
+            start = end
+
+    rotations = iter(list(map(tuple, arrays['rotations'].tolist())))
+    keyframes = iter([model.Keyframe(tuple(row[0:3]), list(islice(rotations, count)),
+                                     tuple(row[3:6]), tuple(row[6:9]))
+                      for row, count in zip(arrays['keyframes'].tolist(),
+                                            arrays['rotation_counts'].tolist())])
+    dispatches = iter([model.Dispatch(*row) for row in arrays['dispatches'].tolist()])
+    state_changes = iter([(state, list(islice(dispatches, count)))
+                          for state, count in arrays['state_changes'].tolist()])
+    commands = iter(map(tuple, unflatten(arrays['commands'], arrays['command_lengths'])))
+
+    fields = len(ANIMATION_FIELDS)
+    animations = []
+    for row in arrays['animations'].tolist():
+        keyframes_count, changes_count, commands_count = row[fields:]
+        values = dict(zip(ANIMATION_FIELDS, row))
+        values['keyFrames'] = list(islice(keyframes, keyframes_count))
+        values['stateChanges'] = dict(islice(state_changes, changes_count))
+        values['commands'] = list(islice(commands, commands_count))
+        animations.append(model.Animation(**values))
+    animations = iter(animations)
+
+    joints = iter(unflatten(arrays['joints'], arrays['joint_lengths']))
+    movable_meshes = iter(arrays['movable_meshes'].tolist())
+    movables = [model.Movable(idx, [meshes[i] for i in islice(movable_meshes, meshes_count)],
+                              list(islice(joints, joints_count)),
+                              list(islice(animations, animations_count)))
+                for idx, meshes_count, joints_count, animations_count
+                in arrays['movables'].tolist()]
+    statics = [model.Static(idx, meshes[i]) for idx, i in arrays['statics'].tolist()]
+
+    return model.Wad(version, statics, mapwidth, mapheight, arrays['texture_map'],
+                     movables, list(arrays['texture_pages']))
+
+
+def load(path):
+    np = data.np
+    # the garbage collector would walk the whole object graph many
+    # times while it is being built
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with np.load(path, allow_pickle=False) as entry:
+            wad = unpack(entry)
+    except OSError:
+        # missing, or not readable right now: the entry may still be valid
+        return None
+    except (EOFError, zipfile.BadZipFile, ValueError, KeyError, IndexError):
+        # truncated or written by an incompatible version
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    os.utime(path)  # mark as recently used
+    return wad
+
+
+def store(path, wad):
+    arrays = pack(wad)
+    write_atomic(path, lambda f: data.np.savez(f, **arrays))
+
+
+def evict(cache_dir, max_size):
+    """delete least recently used entries, the newest one is always kept,
+    and forget the WADs whose entries are all deleted"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith('wad') and entry.name.endswith('.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in entries[:-1]:
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+
+    index = load_index(cache_dir)
+    digests = {os.path.basename(path).split('_')[2] for _, _, path in entries[evicted:]}
+    kept = {path: key for path, key in index.items() if key[2] in digests}
+    if len(kept) < len(index):
+        store_index(cache_dir, kept)
+
+
+def readWAD(f, options, cache_dir, max_size=MAX_SIZE):
+    """same as read.readWAD(f, options, compact=True), but unchanged WADs
+    are loaded from cache_dir"""
+    if not data.HAS_NUMPY:
+        return read.readWAD(f, options, compact=True)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = file_key(f)
+    index = load_index(cache_dir)
+    f = data.BufferReader.open(f)
+    try:
+        if key is not None and index.get(key[0], [])[:2] == list(key[1:]):
+            digest = index[key[0]][2]
+        else:
+            digest = content_digest(f.buffer)
+            if key is not None:
+                index[key[0]] = [key[1], key[2], digest]
+                store_index(cache_dir, index)
+
+        path = os.path.join(cache_dir, entry_name(digest, options))
+        wad = load(path)
+        if wad is None:
+            wad = read.readWAD(f.buffer, options, compact=True)
+            store(path, wad)
+            evict(cache_dir, max_size)
+    finally:
+        f.close()
+
+    return wad
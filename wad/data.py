@@ -1,22 +1,125 @@
+from collections import namedtuple
 from dataclasses import dataclass
+import io
+import mmap
 import struct
 from typing import List
 from math import pi
 
+
+def detect_numpy():
+    """look for numpy, the vectorized decoders are used when it is found"""
+    global np, HAS_NUMPY
+    try:
+        import numpy as np
+        HAS_NUMPY = True
+    except ImportError:
+        HAS_NUMPY = False
+    return HAS_NUMPY
+
+
+detect_numpy()
+
+
+class BufferReader:
+    """Cursor over an in-memory WAD (bytes, memoryview or mmap).
+
+    It exposes the file methods used by the decoders, but fields are decoded
+    in place with unpack_from, without allocating intermediate bytes."""
+
+    def __init__(self, buffer, offset=0, mapping=None):
+        self.buffer = memoryview(buffer)
+        self.offset = offset
+        # memory map created by open(), unmapped by close()
+        self.mapping = mapping
+
+    @classmethod
+    def open(cls, f):
+        """wrap a bytes-like object or memory-map an open file"""
+        if isinstance(f, cls):
+            return f
+
+        if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+            return cls(f)
+
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return cls(buffer, f.tell(), buffer)
+        except (AttributeError, OSError, ValueError):
+            # in-memory streams and empty files cannot be mapped
+            return cls(f.read())
+
+    def close(self):
+        """unmap the file mapped by open(), the views returned by read()
+        must have been dropped"""
+        if self.mapping is None:
+            return
+
+        try:
+            self.buffer.release()
+            self.mapping.close()
+        except BufferError:
+            # a view is still alive, the file is unmapped once it is
+            # garbage collected
+            return
+        self.mapping = None
+
+    def read(self, n=-1):
+        """return a zero-copy view of the next n bytes"""
+        start = self.offset
+        end = len(self.buffer) if n < 0 else min(start + n, len(self.buffer))
+        self.offset = end
+        return self.buffer[start:end]
+
+    def unpack(self, s):
+        values = s.unpack_from(self.buffer, self.offset)
+        self.offset += s.size
+        return values
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.offset
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+        self.offset = offset
+        return offset
+
+    def tell(self):
+        return self.offset
+
+
+UINT32 = struct.Struct('I')
+INT32 = struct.Struct('i')
+UINT16 = struct.Struct('H')
+INT16 = struct.Struct('h')
+
+
+def unpack(f, s):
+    """decode a precompiled struct from a file or a BufferReader"""
+    if isinstance(f, BufferReader):
+        return f.unpack(s)
+    return s.unpack(f.read(s.size))
+
+
 def read_uint32(f):
-    return struct.unpack('I', f.read(4))[0]
+    return unpack(f, UINT32)[0]
 
 
 def read_int32(f):
-    return struct.unpack('i', f.read(4))[0]
+    return unpack(f, INT32)[0]
 
 
 def read_uint16(f):
-    return struct.unpack('H', f.read(2))[0]
+    return unpack(f, UINT16)[0]
 
 
 def read_int16(f):
-    return struct.unpack('h', f.read(2))[0]
+    return unpack(f, INT16)[0]
+
+
+def read_array(f, code, count):
+    """decode count consecutive values of the same struct type code"""
+    return list(unpack(f, struct.Struct('{}{}'.format(count, code))))
 
 def split(test_image):
     import numpy as np
@@ -25,47 +128,48 @@ def split(test_image):
     for r in range(0, test_image.shape[0], 256):
         page = test_image[r:r+256, 0:256]
         page = np.flipud(page)
-        page = page.astype(float)
-        page /= 255
-        pages.append(page.flatten().tolist())
+        pages.append(page)
 
     return pages
 
+
+def to_rgba(raw_data, map_width, map_height):
+    """add an alpha channel to RAW 24bits [RGB] pixels, magenta is transparent"""
+    import numpy as np
+
+    im = np.frombuffer(raw_data, dtype='uint8')
+    im = np.reshape(im, (map_height, map_width, 3))
+    data = np.dstack(
+        (im, np.zeros((map_height, map_width), dtype=np.uint8)+255))
+    r1, g1, b1 = 255, 0, 255  # Original value
+    r2, g2, b2, a2 = 0, 0, 0, 0  # Value that we want to replace it with
+
+    red, green, blue, alpha = data[:, :, 0], data[:,
+                                                  :, 1], data[:, :, 2], data[:, :, 3]
+    mask = (red == r1) & (green == g1) & (blue == b1)
+    data[:, :, :4][mask] = [r2, g2, b2, a2]
+    return data
+
+
 def read_texture_map(f, texture_byte_size, map_width, map_height):
-    """texture map is stored as a standard RAW 24bits [RGB] pixel file"""
+    """texture map is stored as a standard RAW 24bits [RGB] pixel file
 
-    try:
-        import numpy as np
-        HAS_NUMPY = True
-    except ImportError:
-        HAS_NUMPY = False
+    The RGBA pixels are returned bottom row first, as image.pixels expects,
+    in a (height, width, 4) uint8 array (a flat bytearray without numpy).
+    Use pixels_to_float to get the values to assign to a Blender image."""
 
     raw_data = f.read(texture_byte_size)
 
     if HAS_NUMPY:
-        im = np.frombuffer(raw_data, dtype='uint8')
-        im = np.reshape(im, (map_height, map_width, 3))
-        data = np.dstack(
-            (im, np.zeros((map_height, map_width), dtype=np.uint8)+255))
-        r1, g1, b1 = 255, 0, 255  # Original value
-        r2, g2, b2, a2 = 0, 0, 0, 0  # Value that we want to replace it with
-
-        red, green, blue, alpha = data[:, :, 0], data[:,
-                                                      :, 1], data[:, :, 2], data[:, :, 3]
-        mask = (red == r1) & (green == g1) & (blue == b1)
-        data[:, :, :4][mask] = [r2, g2, b2, a2]
-
+        data = to_rgba(raw_data, map_width, map_height)
         data = np.flipud(data)
-        data = data.astype(float)
-        data /= 255
 
-
-        return data.flatten().tolist(), raw_data
+        return data, raw_data
     else:
         pixels = []
         idx = 0
         for _y in range(map_height):
-            row = []
+            row = bytearray()
             for _x in range(map_width):
                 red, green, blue = raw_data[idx:idx + 3]
                 idx += 3
@@ -74,42 +178,33 @@ def read_texture_map(f, texture_byte_size, map_width, map_height):
                 else:
                     alpha = 255
 
-                row += [red, green, blue, alpha]
+                row += bytes((red, green, blue, alpha))
 
             pixels.append(row)
 
         # flip to move uv origin from bottom left to top left
         pixels.reverse()
-        img_pixels = []
-        for row in pixels:
-            for val in row:
-                img_pixels.append(val/255)
+        img_pixels = bytearray().join(pixels)
 
         return img_pixels, raw_data
 
 
 def read_splitted_texture_map(raw_data, texture_byte_size, map_width, map_height):
     """texture map is stored as a standard RAW 24bits [RGB] pixel file"""
+    data = to_rgba(raw_data, map_width, map_height)
+    return split(data)
 
-    try:
-        import numpy as np
-        HAS_NUMPY = True
-    except ImportError:
-        HAS_NUMPY = False
-
-    im = np.frombuffer(raw_data, dtype='uint8')
-    im = np.reshape(im, (map_height, map_width, 3))
-    data = np.dstack(
-        (im, np.zeros((map_height, map_width), dtype=np.uint8)+255))
-    r1, g1, b1 = 255, 0, 255  # Original value
-    r2, g2, b2, a2 = 0, 0, 0, 0  # Value that we want to replace it with
 
-    red, green, blue, alpha = data[:, :, 0], data[:,
-                                                    :, 1], data[:, :, 2], data[:, :, 3]
-    mask = (red == r1) & (green == g1) & (blue == b1)
-    data[:, :, :4][mask] = [r2, g2, b2, a2]
+def pixels_to_float(pixels):
+    """convert uint8 pixels to the [0, 1] floats of a Blender image, as a
+    float32 buffer that can be passed to image.pixels.foreach_set"""
+    if HAS_NUMPY:
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        values = np.empty(pixels.shape, dtype=np.float32)
+        np.divide(pixels, np.float32(255), out=values)
+        return values.reshape(-1)
 
-    return split(data)
+    return [val / 255 for val in pixels]
 
 
 @dataclass
@@ -117,11 +212,28 @@ class DecoderInterface:
     size: int
     format: str
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.layout = struct.Struct(cls.format)
+        if 'Record' not in cls.__dict__:
+            fields = cls.__dict__.get('__annotations__', {})
+            cls.Record = namedtuple(cls.__name__ + 'Record', fields)
+            cls.Record.__qualname__ = cls.__qualname__ + '.Record'
+
     @classmethod
     def decode(cls, f):
-        data = struct.unpack(cls.format, f.read(cls.size))
+        data = unpack(f, cls.layout)
         return cls(cls.size, cls.format, *data)
 
+    @classmethod
+    def decode_table(cls, f, count):
+        """decode count consecutive records in a single iter_unpack pass
+
+        Records are lightweight namedtuples (cls.Record) exposing the same
+        attributes as the dataclass."""
+        raw = f.read(cls.size * count)
+        return list(map(cls.Record._make, cls.layout.iter_unpack(raw)))
+
 
 @dataclass
 class TextureSamples(DecoderInterface):
@@ -136,6 +248,26 @@ class TextureSamples(DecoderInterface):
     size = 8
     format = '2B H b B b B'
 
+    class Record(namedtuple('Record', 'x y page flipX addW flipY addH')):
+        __slots__ = ()
+
+        # map-relative coordinates
+        @property
+        def mapX(self):
+            return self.x
+
+        @property
+        def mapY(self):
+            return self.y + 256 * self.page
+
+        @property
+        def width(self):
+            return self.addW + 1
+
+        @property
+        def height(self):
+            return self.addH + 1
+
     def __post_init__(self):
         assert -1 <= self.flipX <= 0 and -1 <= self.flipY <= 0
 
@@ -145,6 +277,12 @@ class TextureSamples(DecoderInterface):
         self.width = self.addW + 1
         self.height = self.addH + 1
 
+    @classmethod
+    def decode_table(cls, f, count):
+        samples = super().decode_table(f, count)
+        assert all(-1 <= s.flipX <= 0 and -1 <= s.flipY <= 0 for s in samples)
+        return samples
+
 
 @dataclass
 class BoundingSphere(DecoderInterface):
@@ -158,6 +296,11 @@ class BoundingSphere(DecoderInterface):
     format = '3h 2H'
 
 
+# vertices, texture and attributes, followed by an unknown byte
+TRIANGLE = struct.Struct('3H H B x')
+QUAD = struct.Struct('4H H B x')
+
+
 @dataclass
 class Polygon():
     shape: int  # a triangle (8), or a quad (9)
@@ -172,14 +315,9 @@ class Polygon():
     @staticmethod
     def decode(f):
         shape = read_uint16(f)
-        if shape == 8:
-            vertices = struct.unpack('3H', f.read(6))
-        else:
-            vertices = struct.unpack('4H', f.read(8))
-
-        texture = read_uint16(f)
-        attributes = struct.unpack('B', f.read(1))[0]
-        f.read(1)  # unknown
+        values = unpack(f, TRIANGLE if shape == 8 else QUAD)
+        vertices = values[:-2]
+        texture, attributes = values[-2:]
 
         texture_flipped = (texture & 0X8000) >> 15
         texture_shape = (texture & 0X7000) >> 12
@@ -200,6 +338,54 @@ class Polygon():
                        texture_index, intensity, shine, opacity)
 
 
+def decode_polygons(f, count):
+    """vectorized Polygon.decode of count consecutive polygons of a
+    BufferReader, requires numpy
+
+    Returns a dict of arrays named after the Polygon fields, vertices is a
+    (count, 4) array whose last column is 0 for triangles"""
+    import numpy as np
+
+    buffer, offset = f.buffer, f.offset
+    assert offset % 2 == 0
+
+    # the size of a polygon depends on its shape, so they are located one
+    # at a time before decoding them all at once
+    starts = []
+    for _ in range(count):
+        starts.append(offset)
+        shape, = UINT16.unpack_from(buffer, offset)
+        offset += UINT16.size + (TRIANGLE.size if shape == 8 else QUAD.size)
+    f.offset = offset
+
+    words = np.frombuffer(buffer, dtype=np.uint16, count=len(buffer) // 2)
+    starts = np.array(starts, dtype=np.int64) // 2
+
+    shape = words[starts].astype(np.int64)
+    vertices_count = np.where(shape == 8, 3, 4)
+    vertices = words[starts[:, None] + np.arange(1, 5)].astype(np.int64)
+    vertices[vertices_count == 3, 3] = 0
+    texture = words[starts + 1 + vertices_count].astype(np.int64)
+    attributes = words[starts + 2 + vertices_count].astype(np.int64) & 0XFF
+
+    texture_flipped = (texture & 0X8000) >> 15
+    texture_shape = (texture & 0X7000) >> 12
+    assert np.isin(texture_shape, (0, 2, 4, 6, 7)).all()
+
+    texture_index = np.where(shape == 8, texture & 0X0FFF,
+                             np.where(texture_flipped == 1, 0X10000 - texture, texture))
+
+    return {'shape': shape,
+            'vertices': vertices,
+            'vertices_count': vertices_count,
+            'texture_flipped': texture_flipped,
+            'texture_shape': texture_shape,
+            'texture_index': texture_index,
+            'intensity': (attributes & 0X7C) >> 2,
+            'shine': (attributes & 0X02) >> 1,
+            'opacity': attributes & 0X01}
+
+
 @dataclass
 class ShortVector3D(DecoderInterface):
     vx: int
@@ -259,6 +445,21 @@ class Animation(DecoderInterface):
     size = 40
     format = 'I 2B H 2h i q 8H'
 
+    class Record(namedtuple('Record', 'keyframe_offset frame_duration '
+                            'keyframe_size state_ID unknown1 speed acceleration '
+                            'unknown2 frame_start frame_end next_animation '
+                            'frame_in num_state_changes changes_index '
+                            'num_commands commands_offset')):
+        __slots__ = ()
+
+        @property
+        def acceleration_as_float(self):
+            return self.acceleration / 65536
+
+        @property
+        def number_of_frames(self):
+            return self.frame_end - self.frame_start + 1
+
     def __post_init__(self):
         self.acceleration_as_float = self.acceleration / 65536
         self.number_of_frames = self.frame_end - self.frame_start + 1
@@ -310,6 +511,69 @@ class Keyframes:
         return Keyframes(bb1, bb2, off, rotations)
 
 
+def decode_keyframes(buffer, layouts):
+    """vectorized Keyframes.decode over the whole keyframes package, requires
+    numpy
+
+    layouts holds (offset, keyframes count, meshes count, keyframe size)
+    for each animation. For each one, bb1, bb2 and off are returned as
+    (frames, 3) arrays and rotations as a (frames, meshes, 3) array"""
+    import numpy as np
+
+    if not layouts:
+        return []
+
+    words = np.frombuffer(buffer, dtype=np.uint16, count=len(buffer) // 2)
+    offsets, counts, meshes, sizes = np.array(layouts, dtype=np.int64).T
+    assert (offsets % 2 == 0).all()
+
+    # position of the first word of each keyframe of every animation
+    anim_of_frame = np.repeat(np.arange(len(layouts)), counts)
+    first_frames = np.cumsum(counts) - counts
+    frame_idx = np.arange(counts.sum()) - first_frames[anim_of_frame]
+    starts = offsets[anim_of_frame] // 2 + frame_idx * sizes[anim_of_frame]
+
+    # the first 9 words are bb1, bb2 and off
+    vectors = words[starts[:, None] + np.arange(9)].view(np.int16)
+    vectors = vectors.reshape(-1, 3, 3)
+
+    # rotations take one or two words each, so every keyframe keeps its
+    # own cursor and all the keyframes advance one mesh at a time
+    rotations = np.zeros((len(starts), meshes.max(), 3))
+    frame_meshes = meshes[anim_of_frame]
+    cursor = starts + 9
+    for mesh in range(meshes.max()):
+        frames = np.flatnonzero(frame_meshes > mesh)
+        angleSet = words[cursor[frames]].astype(np.int64)
+        axes = angleSet & 0XC000
+
+        # three axes, 10 bits each
+        xyz = axes == 0X0000
+        packed = angleSet[xyz] * 0X10000 + words[cursor[frames[xyz]] + 1]
+        rotz = (packed & 0X3FF) * 2 * pi / 1024
+        packed >>= 10
+        roty = (packed & 0X3FF) * 2 * pi / 1024
+        packed >>= 10
+        rotx = (packed & 0X3FF) * 2 * pi / 1024
+        rotations[frames[xyz], mesh] = np.stack((rotx, roty, rotz), axis=1)
+
+        # single axis, 14 bits
+        for axis, code in enumerate((0X4000, 0X8000, 0XC000)):
+            single = axes == code
+            rotations[frames[single], mesh, axis] = \
+                (angleSet[single] & 0X3FFF) * 2 * pi / 4096
+
+        cursor[frames] += 1 + xyz
+
+    keyframes = []
+    for i, (first, count) in enumerate(zip(first_frames, counts)):
+        frames = slice(first, first + count)
+        bb1, bb2, off = np.moveaxis(vectors[frames], 1, 0)
+        keyframes.append((bb1, bb2, off, rotations[frames, :meshes[i]]))
+
+    return keyframes
+
+
 @dataclass
 class Movable(DecoderInterface):
     obj_ID: int  # unique ID number for this Movable
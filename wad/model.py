@@ -1,6 +1,7 @@
+from array import array
 from collections import namedtuple
 from dataclasses import dataclass
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Sequence
 
 Point = namedtuple('Point', ('x', 'y', 'z'))
 Dispatch = namedtuple('Dispatch', ('inRange', 'outRange', 'nextAnim', 'frameIn'))
@@ -24,7 +25,8 @@ class Polygon:
     y: int
 
 
-@dataclass
+# meshes are shared by all the objects referencing them
+@dataclass(frozen=True)
 class Mesh:
     vertices: List[Point]
     polygons: List[Polygon]
@@ -34,6 +36,159 @@ class Mesh:
     shades: List[int]
 
 
+# polygon attributes packed by ArrayMesh, (shift, mask) of each field
+INTENSITY = (0, 0x1F)
+SHINE = (5, 0x1)
+OPACITY = (6, 0x1)
+ORDER = (7, 0x7)
+FLIP_X = (10, 0x1)
+FLIP_Y = (11, 0x1)
+
+
+def pack_attributes(intensity, shine, opacity, order, flipX, flipY):
+    return (intensity | shine << SHINE[0] | opacity << OPACITY[0] |
+            order << ORDER[0] | flipX << FLIP_X[0] | flipY << FLIP_Y[0])
+
+
+def unpack_attribute(attributes, field):
+    """field of packed attributes, an int or a numpy array of them"""
+    shift, mask = field
+    return attributes >> shift & mask
+
+
+class ArrayMesh:
+    """Mesh stored as flat typed arrays, returned by
+    readWAD(f, options, compact=True)
+
+    Polygon i uses the vertices face_indices[face_starts[i]:face_starts[i + 1]],
+    its uv corners (a, b, c, d) are uv_rects[8 * i:8 * i + 8], its texture
+    sample (x, y, width, height) is texture_rects[4 * i:4 * i + 4] and its
+    other fields are packed in attributes[i].
+
+    vertices, normals, shades and polygons give the same values as Mesh,
+    they are built on each access."""
+
+    __slots__ = ('coords', 'normal_coords', 'shade_values', 'face_starts',
+                 'face_indices', 'uv_rects', 'texture_rects', 'pages',
+                 'attributes', 'boundingSphereCenter', 'boundingSphereRadius')
+
+    def __init__(self, boundingSphereCenter, boundingSphereRadius):
+        self.coords = array('h')  # x, y, z of each vertex
+        self.normal_coords = array('f')
+        self.shade_values = array('H')  # 0 to 255
+        self.face_starts = array('I', [0])
+        self.face_indices = array('H')
+        self.uv_rects = array('f')  # uvs are float32 in blender too
+        self.texture_rects = array('H')
+        self.pages = array('H')
+        self.attributes = array('H')
+        self.boundingSphereCenter = boundingSphereCenter
+        self.boundingSphereRadius = boundingSphereRadius
+
+    @classmethod
+    def from_mesh(cls, mesh):
+        """ArrayMesh holding the values of a Mesh"""
+        array_mesh = cls(mesh.boundingSphereCenter, mesh.boundingSphereRadius)
+        for v in mesh.vertices:
+            array_mesh.coords.extend(v)
+        for n in mesh.normals:
+            array_mesh.normal_coords.extend(n)
+        array_mesh.shade_values.extend(mesh.shades)
+
+        for p in mesh.polygons:
+            array_mesh.face_indices.extend(p.face)
+            array_mesh.face_starts.append(len(array_mesh.face_indices))
+            for u, v in p.tbox:
+                array_mesh.uv_rects.extend((u, v))
+            array_mesh.texture_rects.extend((p.x, p.y, p.tex_width, p.tex_height))
+            array_mesh.pages.append(p.page)
+            array_mesh.attributes.append(pack_attributes(
+                p.intensity, p.shine, p.opacity, p.order, p.flipX, p.flipY))
+
+        return array_mesh
+
+    @property
+    def vertices(self):
+        c = self.coords
+        return list(map(Point, c[0::3], c[1::3], c[2::3]))
+
+    @property
+    def normals(self):
+        n = self.normal_coords
+        return list(zip(n[0::3], n[1::3], n[2::3]))
+
+    @property
+    def shades(self):
+        return self.shade_values.tolist()
+
+    @property
+    def polygons(self):
+        return [PolygonView(self, i) for i in range(len(self.pages))]
+
+
+def attribute(field, kind=int):
+    shift, mask = field
+
+    def getter(self):
+        return kind(self.mesh.attributes[self.i] >> shift & mask)
+
+    return property(getter)
+
+
+class PolygonView:
+    """read-only Polygon-like access to polygon i of an ArrayMesh"""
+
+    __slots__ = ('mesh', 'i')
+
+    def __init__(self, mesh, i):
+        self.mesh = mesh
+        self.i = i
+
+    @property
+    def face(self):
+        mesh = self.mesh
+        start, end = mesh.face_starts[self.i], mesh.face_starts[self.i + 1]
+        return tuple(mesh.face_indices[start:end])
+
+    @property
+    def tbox(self):
+        uv = self.mesh.uv_rects[8 * self.i:8 * self.i + 8]
+        return list(zip(uv[0::2], uv[1::2]))
+
+    @property
+    def origin(self):
+        # top left corner, before flipping
+        uv = self.mesh.uv_rects[8 * self.i:8 * self.i + 8]
+        return (min(uv[0::2]), max(uv[1::2]))
+
+    @property
+    def page(self):
+        return self.mesh.pages[self.i]
+
+    @property
+    def x(self):
+        return self.mesh.texture_rects[4 * self.i]
+
+    @property
+    def y(self):
+        return self.mesh.texture_rects[4 * self.i + 1]
+
+    @property
+    def tex_width(self):
+        return self.mesh.texture_rects[4 * self.i + 2]
+
+    @property
+    def tex_height(self):
+        return self.mesh.texture_rects[4 * self.i + 3]
+
+    intensity = attribute(INTENSITY)
+    shine = attribute(SHINE)
+    opacity = attribute(OPACITY)
+    order = attribute(ORDER)
+    flipX = attribute(FLIP_X, bool)
+    flipY = attribute(FLIP_Y, bool)
+
+
 @dataclass
 class Static:
     idx: int
@@ -77,6 +232,57 @@ class Wad:
     statics: List[Static]
     mapwidth: int
     mapheight: int
-    textureMap: List[float]
+    textureMap: Sequence[int]  # RGBA uint8 pixels, bottom row first
     movables: List[Movable]
-    textureMaps: List[List[float]]
+    textureMaps: List[Sequence[int]]  # 256x256 pages, same layout
+
+    def close(self):
+        """the WAD file is released once read, see LazyWad.close"""
+
+
+def lazy(name):
+    """read-only attribute computed on first access by the loader stored in
+    self.loaders[name]"""
+    def getter(self):
+        if name not in self.__dict__:
+            self.__dict__[name] = self.loaders.pop(name)()
+        return self.__dict__[name]
+
+    return property(getter)
+
+
+# returned by readWAD(f, options, lazy=True)
+class LazyStatic(Static):
+    def __init__(self, idx, mesh):
+        self.idx = idx
+        self.loaders = {'mesh': mesh}
+
+    mesh = lazy('mesh')
+
+
+class LazyMovable(Movable):
+    def __init__(self, idx, joints, meshes, animations):
+        self.idx = idx
+        self.joints = joints
+        self.loaders = {'meshes': meshes, 'animations': animations}
+
+    meshes = lazy('meshes')
+    animations = lazy('animations')
+
+
+class LazyWad(Wad):
+    """close() releases the WAD file, the objects and textures that have
+    not been accessed yet can no longer be decoded"""
+
+    def __init__(self, version, statics, mapwidth, mapheight, textureMap,
+                 movables, textureMaps, close):
+        self.version = version
+        self.statics = statics
+        self.mapwidth = mapwidth
+        self.mapheight = mapheight
+        self.movables = movables
+        self.loaders = {'textureMap': textureMap, 'textureMaps': textureMaps}
+        self.close = close
+
+    textureMap = lazy('textureMap')
+    textureMaps = lazy('textureMaps')
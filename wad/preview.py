@@ -1,31 +1,40 @@
+import io
+import os
+from collections import OrderedDict
+
 from . import data
 
+# (path, mtime, game) -> (movables names, statics names)
+preview_cache = OrderedDict()
+PREVIEW_CACHE_SIZE = 16
+
 
 def preview(f, movable_names, static_names):
+    # seek past everything but the movables and statics tables
     data.read_uint32(f)
     texture_samples_count = data.read_uint32(f)
-    f.read(8 * texture_samples_count)
+    f.seek(8 * texture_samples_count, io.SEEK_CUR)
     bytes_size = data.read_uint32(f)
-    f.read(bytes_size)
+    f.seek(bytes_size, io.SEEK_CUR)
     mesh_pointers_count = data.read_uint32(f)
-    f.read(mesh_pointers_count * 4)
+    f.seek(mesh_pointers_count * 4, io.SEEK_CUR)
     words_size = data.read_uint32(f)
-    f.read(words_size * 2)
+    f.seek(words_size * 2, io.SEEK_CUR)
     animations_count = data.read_uint32(f)
-    f.read(animations_count * 40)
+    f.seek(animations_count * 40, io.SEEK_CUR)
     state_changes_count = data.read_uint32(f)
-    f.read(state_changes_count * 6)
+    f.seek(state_changes_count * 6, io.SEEK_CUR)
     dispatches_count = data.read_uint32(f)
-    f.read(dispatches_count*8)
+    f.seek(dispatches_count * 8, io.SEEK_CUR)
     words_size = data.read_uint32(f)
-    f.read(words_size * 2)
+    f.seek(words_size * 2, io.SEEK_CUR)
     dwords_size = data.read_uint32(f)
-    f.read(dwords_size * 4)
+    f.seek(dwords_size * 4, io.SEEK_CUR)
     keyframes_words_size = data.read_uint32(f)
-    f.read(keyframes_words_size * 2)
+    f.seek(keyframes_words_size * 2, io.SEEK_CUR)
 
     movables_count = data.read_uint32(f)
-    movables_data = [data.Movable.decode(f) for _ in range(movables_count)]
+    movables_data = data.Movable.decode_table(f, movables_count)
     movables = []
     for mov in movables_data:
         idx = str(mov.obj_ID)
@@ -36,7 +45,7 @@ def preview(f, movable_names, static_names):
 
 
     statics_count = data.read_uint32(f)
-    statics_data = [data.Static.decode(f) for _ in range(statics_count)]
+    statics_data = data.Static.decode_table(f, statics_count)
     statics = []
     for stat in statics_data:
         idx = str(stat.obj_ID)
@@ -46,3 +55,20 @@ def preview(f, movable_names, static_names):
             statics.append('STATIC' + idx)
 
     return movables, statics
+
+
+def preview_file(filepath, game, movable_names, static_names):
+    """preview of a WAD file, the last results are kept until the file changes"""
+    key = (filepath, os.stat(filepath).st_mtime_ns, game)
+    if key in preview_cache:
+        preview_cache.move_to_end(key)
+        return preview_cache[key]
+
+    with open(filepath, "rb") as f:
+        result = preview(f, movable_names, static_names)
+
+    preview_cache[key] = result
+    if len(preview_cache) > PREVIEW_CACHE_SIZE:
+        preview_cache.popitem(last=False)
+
+    return result
@@ -1,69 +1,75 @@
-import io
+from collections import Counter
+from functools import partial
+
 from . import model
 from . import data
 
 
-def read_mesh(mesh, texture_samples, map_width, map_height, options):
-    vertices = [(e.vx, e.vy, e.vz) for e in mesh["vertices"]]
-    normals = [(e.vx, e.vy, e.vz) for e in mesh["normals"]]
-    bs = mesh["bounding_sphere"]
-    bounding_sphere_center = model.Point(bs.cx, bs.cy, bs.cz)
-    bounding_sphere_radius = bs.radius
-    shades = mesh["shades"]
-    polygons = []
-    for polygon in mesh["polygons"]:
-        tex = texture_samples[polygon.texture_index]
+def uv_rect(tex, texture_flipped, map_width, map_height, options):
+    """uv corners of a polygon texture, its horizontal flip and the top left
+    corner before flipping"""
+    if options.texture_pages:
+        # top left in uv coordinates
+        x0 = tex.x / 256
+        y0 = 1 - tex.y / 256
 
-        if options.texture_pages:
-            # top left in uv coordinates
-            x0 = tex.x / 256
-            y0 = 1 - tex.y / 256
+        # bottom right in uv coordinates
+        x1 = (tex.x + tex.width) / 256
+        y1 = 1 - (tex.y + tex.height) / 256
+    else:
+        # top left in uv coordinates
+        x0 = tex.mapX / map_width
+        y0 = 1 - tex.mapY / map_height
 
-            # bottom right in uv coordinates
-            x1 = (tex.x + tex.width) / 256
-            y1 = 1 - (tex.y + tex.height) / 256
-        else:
-            # top left in uv coordinates
-            x0 = tex.mapX / map_width
-            y0 = 1 - tex.mapY / map_height
+        # bottom right in uv coordinates
+        x1 = (tex.mapX + tex.width) / map_width
+        y1 = 1 - (tex.mapY + tex.height) / map_height
 
-            # bottom right in uv coordinates
-            x1 = (tex.mapX + tex.width) / map_width
-            y1 = 1 - (tex.mapY + tex.height) / map_height
+    """
+    a         b
+    ###########
+    #         #
+    #         #
+    ###########
+    d         c
+    """
 
-        """
-        a         b
-        ###########
-        #         #
-        #         #
-        ###########
-        d         c
-        """
+    a = (x0, y0)
+    b = (x1, y0)
+    c = (x1, y1)
+    d = (x0, y1)
 
-        a = (x0, y0)
-        b = (x1, y0)
-        c = (x1, y1)
-        d = (x0, y1)
 
+    uvrect = [a, b, c, d]
+    flipX = tex.flipX
+    if tex.flipX == 0:
+        uvrect = [b, a, d, c]
 
-        uvrect = [a, b, c, d]
-        flipX = tex.flipX
-        if tex.flipX == 0:
-            uvrect = [b, a, d, c]
+    if tex.flipY == 0:
+        uvrect = [d, c, b, a]
 
-        if tex.flipY == 0:
-            uvrect = [d, c, b, a]
+    if texture_flipped == 1:
+        flipX = not flipX
+        uvrect = [b, a, d, c]
 
-        if polygon.texture_flipped == 1:
-            flipX = not flipX
-            uvrect = [b, a, d, c]
+    x, y, w, h = tex.mapX, tex.mapY, tex.width, tex.height
+    assert x + w <= map_width and y + h <= map_height
 
-        sample = tex
-        x, y, w, h = sample.mapX, sample.mapY, sample.width, sample.height
-        assert x + w <= map_width and y + h <= map_height
+    return uvrect, flipX, a
 
-        assert tex.mapX + tex.width <= map_width
-        assert tex.mapY + tex.height <= map_height
+
+def read_mesh(mesh, texture_samples, map_width, map_height, options):
+    vertices = [(e.vx, e.vy, e.vz) for e in mesh["vertices"]]
+    normals = [(e.vx, e.vy, e.vz) for e in mesh["normals"]]
+    bs = mesh["bounding_sphere"]
+    bounding_sphere_center = model.Point(bs.cx, bs.cy, bs.cz)
+    bounding_sphere_radius = bs.radius
+    shades = mesh["shades"]
+    polygons = []
+    for polygon in mesh["polygons"]:
+        tex = texture_samples[polygon.texture_index]
+        uvrect, flipX, a = uv_rect(tex, polygon.texture_flipped,
+                                   map_width, map_height, options)
 
         poly_model = model.Polygon(polygon.vertices,
                                    uvrect,
@@ -87,185 +93,473 @@ def read_mesh(mesh, texture_samples, map_width, map_height, options):
                       bounding_sphere_center, bounding_sphere_radius, shades)
 
 
-def readWAD(f, options):
-    version = data.read_uint32(f)
-    assert 129 <= version <= 130
-
-    #####################
-    ### TEXTURES DATA ###
-    #####################
+def read_array_mesh(mesh, texture_samples, map_width, map_height, options):
+    """same as read_mesh, but returns a model.ArrayMesh"""
+    bs = mesh["bounding_sphere"]
+    array_mesh = model.ArrayMesh(model.Point(bs.cx, bs.cy, bs.cz), bs.radius)
 
-    # extract position, size and attitude of each texture sample
-    texture_samples_count = data.read_uint32(f)
-    texture_samples = [data.TextureSamples.decode(f)
-                       for _ in range(texture_samples_count)]
+    for e in mesh["vertices"]:
+        array_mesh.coords.extend((e.vx, e.vy, e.vz))
+    for e in mesh["normals"]:
+        array_mesh.normal_coords.extend((e.vx, e.vy, e.vz))
+    array_mesh.shade_values.extend(mesh["shades"])
 
-    # extract texture map
-    bytes_size = data.read_uint32(f)
-    map_width = 256
-    map_height = bytes_size // 256 // 3
-    texture_map, raw_data = data.read_texture_map(f, bytes_size, map_width, map_height)
-    if options.texture_pages:
-        textureMaps = data.read_splitted_texture_map(raw_data, bytes_size, map_width, map_height)
-    else:
-        textureMaps = []
-
-    _pages_count = bytes_size // 256 // 256 // 3
+    for polygon in mesh["polygons"]:
+        tex = texture_samples[polygon.texture_index]
+        uvrect, flipX, _ = uv_rect(tex, polygon.texture_flipped,
+                                   map_width, map_height, options)
 
-    for sample in texture_samples:
-        x, y, w, h = sample.mapX, sample.mapY, sample.width, sample.height
-        assert x + w <= map_width and y + h <= map_height
+        array_mesh.face_indices.extend(polygon.vertices)
+        array_mesh.face_starts.append(len(array_mesh.face_indices))
+        for u, v in uvrect:
+            array_mesh.uv_rects.extend((u, v))
+        array_mesh.texture_rects.extend((tex.mapX, tex.mapY, tex.width, tex.height))
+        array_mesh.pages.append(tex.page)
+        array_mesh.attributes.append(model.pack_attributes(
+            polygon.intensity, polygon.shine, polygon.opacity,
+            polygon.texture_shape, not flipX, not tex.flipY))
 
-    ###################
-    ### MESHES DATA ###
-    ###################
+    return array_mesh
 
-    mesh_pointers_count = data.read_uint32(f)
-    mesh_pointers = [data.read_uint32(f) for _ in range(mesh_pointers_count)]
 
-    # extract meshes
-    words_size = data.read_uint32(f)
-    mesh_data = []
-    offset_idx = 0
-    offsets = set()
-    while offset_idx < words_size * 2:  # for each mesh
-        offsets.add(offset_idx)
-        mesh = {}
-        mesh["idx"] = offset_idx
-        mesh["bounding_sphere"] = data.BoundingSphere.decode(f)
+# corners order of the uv rects: unchanged, horizontal or vertical flip
+UV_ORDERS = ((0, 1, 2, 3), (1, 0, 3, 2), (3, 2, 1, 0))
 
-        # table storing the XYZ coordinates of the vertices
-        vertices_count = data.read_uint16(f)
-        mesh["vertices"] = [data.ShortVector3D.decode(f)
-                            for _ in range(vertices_count)]
 
-        ns = data.read_int16(f)  # number of normals Or shades
+def read_mesh_arrays(mesh, samples_table, map_width, map_height, options,
+                     compact=False):
+    """vectorized read_mesh (or read_array_mesh if compact is set) of a mesh
+    decoded by decode_mesh_arrays, requires numpy
 
-        normals_count = max(0, ns)
-        mesh["normals"] = [data.ShortVector3D.decode(f)
-                           for _ in range(normals_count)]
-        # normalization
-        for normal in mesh["normals"]:
-            normal /= 16300
+    samples_table is the (count, 7) array of the texture samples records"""
+    import numpy as np
 
-        shades_count = max(0, -ns)
-        shades = [data.read_int16(f) for _ in range(shades_count)]
-        mesh["shades"] = [int(255 - shade * 255 / 8191)
-                          for shade in shades]
+    polygons = mesh["polygons"]
+    x, y, page, flip_x, add_w, flip_y, add_h = samples_table[polygons["texture_index"]].T
+    width = add_w + 1
+    height = add_h + 1
+    map_y = y + 256 * page
 
-        # extract mesh polygons
-        poly_count = data.read_uint16(f)
-        mesh["polygons"] = [data.Polygon.decode(f) for _ in range(poly_count)]
+    if options.texture_pages:
+        x0 = x / 256
+        y0 = 1 - y / 256
+        x1 = (x + width) / 256
+        y1 = 1 - (y + height) / 256
+    else:
+        x0 = x / map_width
+        y0 = 1 - map_y / map_height
+        x1 = (x + width) / map_width
+        y1 = 1 - (map_y + height) / map_height
+
+    # same flips as uv_rect, the last matching one wins
+    texture_flipped = polygons["texture_flipped"] == 1
+    orders = np.where(texture_flipped, 1, np.where(flip_y == 0, 2, np.where(flip_x == 0, 1, 0)))
+    corners = np.stack((x0, y0, x1, y0, x1, y1, x0, y1), axis=1).reshape(-1, 4, 2)
+    uv = corners[np.arange(len(orders))[:, None], np.array(UV_ORDERS)[orders]]
+    flip_x = (flip_x == 0) ^ texture_flipped
+    flip_y = flip_y == 0
 
-        # if the number of quads is odd, there is a 2 bytes padding
-        quads_count = 0
-        for polygon in mesh["polygons"]:
-            assert 0 <= polygon.texture_index < len(texture_samples)
-            if polygon.shape == 9:
-                quads_count += 1
+    bs = mesh["bounding_sphere"]
+    center = model.Point(bs.cx, bs.cy, bs.cz)
+    vertices_count = polygons["vertices_count"]
+
+    if compact:
+        array_mesh = model.ArrayMesh(center, bs.radius)
+        array_mesh.coords.frombytes(mesh["vertices"].astype(np.int16).tobytes())
+        array_mesh.normal_coords.frombytes(mesh["normals"].astype(np.float32).tobytes())
+        array_mesh.shade_values.frombytes(mesh["shades"].astype(np.uint16).tobytes())
+        faces = polygons["vertices"][np.arange(4) < vertices_count[:, None]]
+        array_mesh.face_indices.frombytes(faces.astype(np.uint16).tobytes())
+        array_mesh.face_starts.frombytes(np.cumsum(vertices_count).astype(np.uint32).tobytes())
+        array_mesh.uv_rects.frombytes(uv.astype(np.float32).tobytes())
+        rects = np.stack((x, map_y, width, height), axis=1)
+        array_mesh.texture_rects.frombytes(rects.astype(np.uint16).tobytes())
+        array_mesh.pages.frombytes(page.astype(np.uint16).tobytes())
+        attributes = model.pack_attributes(
+            polygons["intensity"], polygons["shine"], polygons["opacity"],
+            polygons["texture_shape"], flip_x.astype(np.int64), flip_y.astype(np.int64))
+        array_mesh.attributes.frombytes(attributes.astype(np.uint16).tobytes())
+        return array_mesh
+
+    faces = [tuple(face[:n]) for face, n in
+             zip(polygons["vertices"].tolist(), vertices_count.tolist())]
+    # a list of corners for each polygon, built from one column per
+    # coordinate to avoid creating a nested list for each polygon
+    columns = uv.reshape(-1, 8).T.tolist()
+    corners = [zip(columns[i], columns[i + 1]) for i in range(0, 8, 2)]
+    tboxes = list(map(list, zip(*corners)))
+    origins = list(zip(x0.tolist(), y0.tolist()))
+    polygons = list(map(model.Polygon, faces, tboxes,
+                        polygons["texture_shape"].tolist(),
+                        polygons["intensity"].tolist(),
+                        polygons["shine"].tolist(),
+                        polygons["opacity"].tolist(),
+                        page.tolist(), width.tolist(), height.tolist(),
+                        flip_x.tolist(), flip_y.tolist(), origins,
+                        x.tolist(), map_y.tolist()))
+
+    return model.Mesh(list(map(tuple, mesh["vertices"].tolist())), polygons,
+                      list(map(tuple, mesh["normals"].tolist())),
+                      center, bs.radius, mesh["shades"].tolist())
+
+
+def read_keyframes(keyframes_data, layouts):
+    """decode the keyframes of many animations at once
+
+    layouts holds (offset, keyframes count, meshes count, keyframe size)
+    for each animation, a list of model.Keyframe is returned for each one"""
+    animations = []
+    if data.HAS_NUMPY:
+        for bb1, bb2, off, rotations in data.decode_keyframes(keyframes_data, layouts):
+            rotations = [list(map(tuple, e)) for e in rotations.tolist()]
+            keyframes = list(map(model.Keyframe,
+                                 map(tuple, off.tolist()), rotations,
+                                 map(tuple, bb1.tolist()), map(tuple, bb2.tolist())))
+            animations.append(keyframes)
+
+        return animations
+
+    for offset, keyframes_count, meshes_count, keyframe_size in layouts:
+        f = data.BufferReader(keyframes_data, offset)
+        keyframes = []
+        for _ in range(keyframes_count):
+            kf = data.Keyframes.decode(f, meshes_count, keyframe_size)
+            offset_idx = (kf.off.vx, kf.off.vy, kf.off.vz)
+            bb1 = (kf.bb1.vx, kf.bb1.vy, kf.bb1.vz)
+            bb2 = (kf.bb2.vx, kf.bb2.vy, kf.bb2.vz)
+
+            keyframe = model.Keyframe(offset_idx, kf.rotations, bb1, bb2)
+            keyframes.append(keyframe)
+
+        animations.append(keyframes)
+
+    return animations
+
+
+def decode_mesh(f, texture_samples_count):
+    """decode the mesh starting at the current position of f"""
+    mesh = {}
+    mesh["bounding_sphere"] = data.BoundingSphere.decode(f)
+
+    # table storing the XYZ coordinates of the vertices
+    vertices_count = data.read_uint16(f)
+    mesh["vertices"] = [data.ShortVector3D.decode(f)
+                        for _ in range(vertices_count)]
+
+    ns = data.read_int16(f)  # number of normals Or shades
+
+    normals_count = max(0, ns)
+    mesh["normals"] = [data.ShortVector3D.decode(f)
+                       for _ in range(normals_count)]
+    # normalization
+    for normal in mesh["normals"]:
+        normal /= 16300
+
+    shades_count = max(0, -ns)
+    shades = [data.read_int16(f) for _ in range(shades_count)]
+    # raw shades outside 0..8191 are clamped to the 0..255 brightness range
+    mesh["shades"] = [min(255, max(0, int(255 - shade * 255 / 8191)))
+                      for shade in shades]
+
+    # extract mesh polygons
+    poly_count = data.read_uint16(f)
+    mesh["polygons"] = [data.Polygon.decode(f) for _ in range(poly_count)]
+
+    # if the number of quads is odd, there is a 2 bytes padding
+    quads_count = 0
+    for polygon in mesh["polygons"]:
+        assert 0 <= polygon.texture_index < texture_samples_count
+        if polygon.shape == 9:
+            quads_count += 1
 
-        if quads_count % 2 == 1:
-            f.read(2)
-            offset_idx += 2
+    if quads_count % 2 == 1:
+        f.read(2)
 
-        offset_idx += 16 + 6 * vertices_count + 12 * poly_count + \
-            6 * normals_count + 2 * shades_count + 2 * quads_count
+    return mesh
 
-        mesh_data.append(mesh)
 
-    for address in mesh_pointers:
-        assert address in offsets
+def decode_mesh_arrays(f, texture_samples_count):
+    """vectorized decode_mesh, requires numpy
 
-    assert offset_idx == words_size * 2
+    vertices and normals are (count, 3) arrays, shades an array and
+    polygons the dict of arrays returned by data.decode_polygons"""
+    import numpy as np
 
-    #######################
-    ### ANIMATIONS DATA ###
-    #######################
+    mesh = {}
+    mesh["bounding_sphere"] = data.BoundingSphere.decode(f)
 
-    animations_count = data.read_uint32(f)
-    animations_data = [data.Animation.decode(f)
-                       for _ in range(animations_count)]
+    vertices_count = data.read_uint16(f)
+    mesh["vertices"] = np.frombuffer(f.read(6 * vertices_count), dtype=np.int16).reshape(-1, 3)
 
-    for animation in animations_data:
-        assert 0 <= animation.next_animation < len(animations_data)
+    ns = data.read_int16(f)  # number of normals Or shades
 
-    state_changes_count = data.read_uint32(f)
-    state_changes_data = [data.StateChanges.decode(f)
-                          for _ in range(state_changes_count)]
+    normals_count = max(0, ns)
+    normals = np.frombuffer(f.read(6 * normals_count), dtype=np.int16)
+    mesh["normals"] = normals.reshape(-1, 3) / 16300
 
-    dispatches_count = data.read_uint32(f)
-    dispatches_data = [data.Dispatches.decode(f)
-                       for _ in range(dispatches_count)]
+    shades_count = max(0, -ns)
+    shades = np.frombuffer(f.read(2 * shades_count), dtype=np.int16)
+    mesh["shades"] = np.clip((255 - shades.astype(np.int64) * 255 / 8191).astype(np.int64), 0, 255)
 
-    for dispatch in dispatches_data:
-        if not 0 <= dispatch.next_anim < len(animations_data):
-            print("Dispatch pointing to invalid animation {}".format(dispatch))
+    # extract mesh polygons
+    poly_count = data.read_uint16(f)
+    polygons = data.decode_polygons(f, poly_count)
+    mesh["polygons"] = polygons
 
-    # extract commands for all the animation segments
-    words_size = data.read_uint32(f)
-    commands_data = []
-    idx = 0
-    while idx < words_size * 2:
-        command = data.read_uint16(f)
-        instruction = [command]
-        if command == 1:
-            instruction += [data.read_int16(f) for _ in range(3)]
-        elif command == 2:
-            instruction += [data.read_int16(f) for _ in range(2)]
-        elif command == 5 or command == 6:
-            instruction += [data.read_uint16(f) for _ in range(2)]
+    texture_index = polygons["texture_index"]
+    assert ((0 <= texture_index) & (texture_index < texture_samples_count)).all()
 
-        commands_data.append((idx, instruction))
-        idx += len(instruction) * 2
+    # if the number of quads is odd, there is a 2 bytes padding
+    if (polygons["shape"] == 9).sum() % 2 == 1:
+        f.read(2)
 
-    # extract links between meshes (also called joints, skeleton or mesh tree)
-    dwords_size = data.read_uint32(f)
-    links_data = [data.read_int32(f) for _ in range(dwords_size)]
+    return mesh
 
-    # animations keyframes (will be parsed later)
-    keyframes_words_size = data.read_uint32(f)
-    keyframes_data_bytes = f.read(2 * keyframes_words_size)
 
-    ###################
-    ### MODELS DATA ###
-    ###################
+class WadReader:
+    """Light first pass over a WAD file
 
-    movables_count = data.read_uint32(f)
-    movables_data = [data.Movable.decode(f) for _ in range(movables_count)]
+    The tables are decoded right away, while the meshes and keyframes
+    packages and the texture map are only located in the buffer, so that
+    the meshes, animations and textures of each object can be decoded
+    on demand."""
 
-    statics_count = data.read_uint32(f)
-    statics_data = [data.Static.decode(f) for _ in range(statics_count)]
+    def __init__(self, f, options, compact=False):
+        f = data.BufferReader.open(f)
+        self.file = f
+        self.options = options
+        # build model.ArrayMesh instead of model.Mesh
+        self.compact = compact
+        self.version = data.read_uint32(f)
+        assert 129 <= self.version <= 130
 
-    assert f.read(1) == b''  # check end of file
+        #####################
+        ### TEXTURES DATA ###
+        #####################
 
-    #######################
-    ### POST PROCESSING ###
-    #######################
+        # extract position, size and attitude of each texture sample
+        texture_samples_count = data.read_uint32(f)
+        self.texture_samples = data.TextureSamples.decode_table(
+            f, texture_samples_count)
 
-    # collect all the data relative to each movable
-    movables = []
-    for mov_idx, mov_data in enumerate(movables_data):
-        movable = {}
-        movable['idx'] = mov_data.obj_ID
+        # locate texture map
+        bytes_size = data.read_uint32(f)
+        self.map_width = 256
+        self.map_height = bytes_size // 256 // 3
+        self.texture_map_data = f.read(bytes_size)
 
-        # get the index of its meshes in the meshes data package
-        movable['mesh_indices'] = []
-        meshes_count = mov_data.num_pointers
-        first_mesh_pointer = mov_data.pointers_index
-        for i in range(meshes_count):
-            mesh_pointer = mesh_pointers[first_mesh_pointer + i]
-            mesh_idx = next(idx
-                            for idx, mesh in enumerate(mesh_data)
-                            if mesh["idx"] == mesh_pointer)
-            movable['mesh_indices'].append(mesh_idx)
+        for sample in self.texture_samples:
+            x, y, w, h = sample.mapX, sample.mapY, sample.width, sample.height
+            assert x + w <= self.map_width and y + h <= self.map_height
 
+        # meshes are decoded and built with numpy when available
+        if data.HAS_NUMPY:
+            import numpy as np
+            self.samples_table = np.array(
+                self.texture_samples, dtype=np.int64).reshape(-1, 7)
+        else:
+            self.samples_table = None
+
+        ###################
+        ### MESHES DATA ###
+        ###################
+
+        mesh_pointers_count = data.read_uint32(f)
+        self.mesh_pointers = data.read_array(f, 'I', mesh_pointers_count)
+
+        # locate meshes (decoded on demand)
+        words_size = data.read_uint32(f)
+        self.meshes_data = f.read(words_size * 2)
+        self.mesh_data = {}  # offset in the meshes package -> decoded mesh
+        self.meshes = {}  # (offset, texture pages) -> model.Mesh
+        self.mesh_users = None  # offset -> objects still to be streamed
+
+        #######################
+        ### ANIMATIONS DATA ###
+        #######################
+
+        animations_count = data.read_uint32(f)
+        self.animations_data = data.Animation.decode_table(f, animations_count)
+
+        for animation in self.animations_data:
+            assert 0 <= animation.next_animation < len(self.animations_data)
+
+        state_changes_count = data.read_uint32(f)
+        self.state_changes_data = data.StateChanges.decode_table(
+            f, state_changes_count)
+
+        dispatches_count = data.read_uint32(f)
+        self.dispatches_data = data.Dispatches.decode_table(f, dispatches_count)
+
+        for dispatch in self.dispatches_data:
+            if not 0 <= dispatch.next_anim < len(self.animations_data):
+                print("Dispatch pointing to invalid animation {}".format(dispatch))
+
+        # extract commands for all the animation segments
+        words_size = data.read_uint32(f)
+        self.commands_data = []
+        # offset in the commands package -> index in commands_data
+        self.command_offsets = {}
+        idx = 0
+        while idx < words_size * 2:
+            command = data.read_uint16(f)
+            instruction = [command]
+            if command == 1:
+                instruction += [data.read_int16(f) for _ in range(3)]
+            elif command == 2:
+                instruction += [data.read_int16(f) for _ in range(2)]
+            elif command == 5 or command == 6:
+                instruction += [data.read_uint16(f) for _ in range(2)]
+
+            self.command_offsets[idx] = len(self.commands_data)
+            self.commands_data.append((idx, instruction))
+            idx += len(instruction) * 2
+
+        # extract links between meshes (also called joints, skeleton or mesh tree)
+        dwords_size = data.read_uint32(f)
+        self.links_data = data.read_array(f, 'i', dwords_size)
+
+        # animations keyframes (will be parsed later)
+        keyframes_words_size = data.read_uint32(f)
+        self.keyframes_data = f.read(2 * keyframes_words_size)
+
+        ###################
+        ### MODELS DATA ###
+        ###################
+
+        movables_count = data.read_uint32(f)
+        self.movables_data = data.Movable.decode_table(f, movables_count)
+
+        statics_count = data.read_uint32(f)
+        self.statics_data = data.Static.decode_table(f, statics_count)
+
+        assert f.read(1) == b''  # check end of file
+
+    def close(self):
+        """release the WAD buffer, nothing can be decoded afterwards"""
+        self.texture_map_data = None
+        self.meshes_data = None
+        self.keyframes_data = None
+        self.mesh_data.clear()
+        self.file.close()
+
+    def read_texture_map(self):
+        f = data.BufferReader(self.texture_map_data)
+        texture_map, _ = data.read_texture_map(
+            f, len(self.texture_map_data), self.map_width, self.map_height)
+        return texture_map
+
+    def read_texture_pages(self):
+        if not self.options.texture_pages:
+            return []
+
+        return data.read_splitted_texture_map(
+            self.texture_map_data, len(self.texture_map_data),
+            self.map_width, self.map_height)
+
+    def decode_meshes(self):
+        """decode and validate the whole meshes package"""
+        f = data.BufferReader(self.meshes_data)
+        offset_idx = 0
+        while offset_idx < len(self.meshes_data):  # for each mesh
+            self.mesh_data[offset_idx] = self.decode_mesh(f)
+            offset_idx = f.tell()
+
+        for address in self.mesh_pointers:
+            assert address in self.mesh_data
+
+        assert offset_idx == len(self.meshes_data)
+
+    def read_mesh(self, mesh_pointer):
+        """objects often share meshes, so each mesh is built once and the
+        same model.Mesh is returned for all its references"""
+        key = (mesh_pointer, self.options.texture_pages)
+        if key in self.meshes:
+            return self.meshes[key]
+
+        # decoded mesh data are not needed once the model mesh is built
+        mesh = self.mesh_data.pop(mesh_pointer, None)
+        if mesh is None:
+            f = data.BufferReader(self.meshes_data, mesh_pointer)
+            mesh = self.decode_mesh(f)
+
+        if self.samples_table is not None:
+            self.meshes[key] = read_mesh_arrays(
+                mesh, self.samples_table, self.map_width, self.map_height,
+                self.options, self.compact)
+        else:
+            build = read_array_mesh if self.compact else read_mesh
+            self.meshes[key] = build(mesh, self.texture_samples, self.map_width,
+                                     self.map_height, self.options)
+        return self.meshes[key]
+
+    def decode_mesh(self, f):
+        if self.samples_table is not None:
+            return decode_mesh_arrays(f, len(self.texture_samples))
+        return decode_mesh(f, len(self.texture_samples))
+
+    def read_static_mesh(self, static_idx):
+        return self.read_mesh(self.static_mesh_pointers(static_idx)[0])
+
+    def static_mesh_pointers(self, static_idx):
+        static = self.statics_data[static_idx]
+        return self.mesh_pointers[static.pointers_index:static.pointers_index + 1]
+
+    def movable_mesh_pointers(self, mov_idx):
+        mov_data = self.movables_data[mov_idx]
+        first = mov_data.pointers_index
+        return self.mesh_pointers[first:first + mov_data.num_pointers]
+
+    def release_meshes(self, mesh_pointers):
+        """forget the meshes of an object which has been streamed, once no
+        other object uses them"""
+        if self.mesh_users is None:
+            self.mesh_users = Counter()
+            for mov_idx in range(len(self.movables_data)):
+                self.mesh_users.update(self.movable_mesh_pointers(mov_idx))
+            for static_idx in range(len(self.statics_data)):
+                self.mesh_users.update(self.static_mesh_pointers(static_idx))
+
+        for pointer in mesh_pointers:
+            self.mesh_users[pointer] -= 1
+            if self.mesh_users[pointer] <= 0:
+                self.meshes.pop((pointer, self.options.texture_pages), None)
+
+    def read_movable_meshes(self, mov_idx):
+        return [self.read_mesh(pointer)
+                for pointer in self.movable_mesh_pointers(mov_idx)]
+
+    def read_movable_joints(self, mov_idx):
         # get links data (op, dx, dy, dz)
+        mov_data = self.movables_data[mov_idx]
         first_link_pointer = mov_data.links_index
-        links_count = meshes_count - 1
-        movable['links'] = []
+        links_count = mov_data.num_pointers - 1
+        links = []
         for i in range(links_count):
             pointer = first_link_pointer + i * 4
-            movable['links'].append(links_data[pointer:pointer + 4])
+            links.append(self.links_data[pointer:pointer + 4])
+
+        return links
+
+    def read_movable_animations(self, mov_idx):
+        animations, keyframes_layouts = self.movable_animations(mov_idx)
+        keyframed_animations = [a for a, _ in keyframes_layouts]
+        layouts = [layout for _, layout in keyframes_layouts]
+        keyframes = read_keyframes(self.keyframes_data, layouts)
+        for animation, animation_keyframes in zip(keyframed_animations, keyframes):
+            animation.keyFrames = animation_keyframes
+
+        return animations
+
+    def movable_animations(self, mov_idx):
+        """animations of a movable without their keyframes
+
+        Also returns (animation, keyframes layout) pairs to decode them"""
+        mov_data = self.movables_data[mov_idx]
+        movables_count = len(self.movables_data)
+        animations_count = len(self.animations_data)
+        animations_data = self.animations_data
+        meshes_count = mov_data.num_pointers
 
         # get animation data
         idx = mov_idx
@@ -277,122 +571,203 @@ def readWAD(f, options):
                 mov_anims_count = len(animations_data) - mov_data.anims_index
                 break
 
-            if movables_data[idx].anims_index >= 0:
-                mov_anims_count = movables_data[idx].anims_index - \
+            if self.movables_data[idx].anims_index >= 0:
+                mov_anims_count = self.movables_data[idx].anims_index - \
                     mov_data.anims_index
                 break
 
-        if mov_anims_count > 0:
-            movable['animations'] = []
-            for anim_idx in range(mov_anims_count):
-                cur_anim = animations_data[mov_data.anims_index + anim_idx]
-
-                # get next animation to deternime the keyframe buffer size
-                next_anim = None
-                next_anim_idx = mov_data.anims_index + anim_idx
-                while True:
-                    next_anim_idx += 1
-                    if next_anim_idx >= animations_count:
-                        break
-
-                    if animations_data[next_anim_idx].keyframe_size > 0:
-                        next_anim = animations_data[next_anim_idx]
-                        break
-
-                # parse animation keyframes
-                if cur_anim.keyframe_size > 0:
-                    if next_anim:
-                        keyframes_count = next_anim.keyframe_offset - cur_anim.keyframe_offset
-                    else:
-                        keyframes_count = keyframes_words_size * 2 - cur_anim.keyframe_offset
-
-                    keyframes_count //= cur_anim.keyframe_size * 2
-
-                    f = io.BytesIO(keyframes_data_bytes)
-                    f.seek(cur_anim.keyframe_offset)
-                    keyframes_data = [data.Keyframes.decode(f, meshes_count, cur_anim.keyframe_size)
-                                      for _ in range(keyframes_count)]
+        animations = []
+        keyframes_layouts = []
+        for anim_idx in range(mov_anims_count):
+            cur_anim = animations_data[mov_data.anims_index + anim_idx]
+
+            # get next animation to deternime the keyframe buffer size
+            next_anim = None
+            next_anim_idx = mov_data.anims_index + anim_idx
+            while True:
+                next_anim_idx += 1
+                if next_anim_idx >= animations_count:
+                    break
+
+                if animations_data[next_anim_idx].keyframe_size > 0:
+                    next_anim = animations_data[next_anim_idx]
+                    break
+
+            # size of the animation keyframes
+            if cur_anim.keyframe_size > 0:
+                if next_anim:
+                    keyframes_count = next_anim.keyframe_offset - cur_anim.keyframe_offset
+                else:
+                    keyframes_count = len(self.keyframes_data) - cur_anim.keyframe_offset
+
+                keyframes_count //= cur_anim.keyframe_size * 2
+            else:
+                keyframes_count = 0
+
+            next_animation = cur_anim.next_animation - mov_data.anims_index
+
+            # Get animation state changes
+            anim_state_changes_count = cur_anim.num_state_changes
+            state_changes = {}
+            for i in range(anim_state_changes_count):
+                state_change_data = self.state_changes_data[cur_anim.changes_index + i]
+                if state_change_data.num_dispatches > 0:
+                    # get animation dispatches
+                    dispatches = []
+                    for j in range(state_change_data.num_dispatches):
+                        d = self.dispatches_data[state_change_data.dispatches_index + j]
+                        dispatch = model.Dispatch(
+                            d.in_range, 
+                            d.out_range, 
+                            d.next_anim - mov_data.anims_index, 
+                            d.frame_in)
+                        dispatches.append(dispatch)
+
+                    state_changes[state_change_data.state_ID] = dispatches
+
+            # Get animation commands
+            commands = []
+            if cur_anim.num_commands > 0:
+                command_it = self.command_offsets.get(2 * cur_anim.commands_offset)
+                if command_it is None:
+                    print("Invalid command")
                 else:
-                    keyframes_count = 0
-                    keyframes_data = []
-
-                keyframes = []
-                for kf in keyframes_data:
-                    offset_idx = (kf.off.vx, kf.off.vy, kf.off.vz)
-                    bb1 = (kf.bb1.vx, kf.bb1.vy, kf.bb1.vz)
-                    bb2 = (kf.bb2.vx, kf.bb2.vy, kf.bb2.vz)
-
-                    keyframe = model.Keyframe(
-                        offset_idx, kf.rotations, bb1, bb2)
-                    keyframes.append(keyframe)
-
-                next_animation = cur_anim.next_animation - mov_data.anims_index
-
-                # Get animation state changes
-                anim_state_changes_count = cur_anim.num_state_changes
-                state_changes = {}
-                for i in range(anim_state_changes_count):
-                    state_change_data = state_changes_data[cur_anim.changes_index + i]
-                    if state_change_data.num_dispatches > 0:
-                        # get animation dispatches
-                        dispatches = []
-                        for j in range(state_change_data.num_dispatches):
-                            d = dispatches_data[state_change_data.dispatches_index + j]
-                            dispatch = model.Dispatch(
-                                d.in_range, 
-                                d.out_range, 
-                                d.next_anim - mov_data.anims_index, 
-                                d.frame_in)
-                            dispatches.append(dispatch)
-
-                        state_changes[state_change_data.state_ID] = dispatches
-
-                # Get animation commands
-                commands = []
-                if cur_anim.num_commands > 0:
-                    try:
-                        command_it = next(i for i, c in enumerate(commands_data) if c[0] == 2 * cur_anim.commands_offset)
-                        for idx in range(cur_anim.num_commands):
-                            if command_it + idx < len(commands_data):
-                                e = tuple(commands_data[command_it + idx][1])
-                                commands.append(e)
-                    except StopIteration:
-                        print("Invalid command")
-
-                animation = model.Animation(
-                    cur_anim.state_ID, keyframes, state_changes, commands, 
-                    cur_anim.frame_duration, cur_anim.speed, 
-                    cur_anim.acceleration, cur_anim.frame_start, 
-                    cur_anim.frame_end, cur_anim.frame_in, next_animation)
-                movable['animations'].append(animation)
+                    last = command_it + cur_anim.num_commands
+                    commands = [tuple(instruction) for _, instruction
+                                in self.commands_data[command_it:last]]
 
-        else:
-            movable['animations'] = []
+            animation = model.Animation(
+                cur_anim.state_ID, [], state_changes, commands, 
+                cur_anim.frame_duration, cur_anim.speed, 
+                cur_anim.acceleration, cur_anim.frame_start, 
+                cur_anim.frame_end, cur_anim.frame_in, next_animation)
+            animations.append(animation)
 
-        movables.append(movable)
+            if keyframes_count > 0:
+                layout = (cur_anim.keyframe_offset, keyframes_count,
+                          meshes_count, cur_anim.keyframe_size)
+                keyframes_layouts.append((animation, layout))
+
+        return animations, keyframes_layouts
+
+
+def readWAD(f, options, lazy=False, compact=False):
+    """f is an open WAD file or a bytes-like object holding its content
+
+    If lazy is set, only the tables are decoded: the meshes and animations
+    of each object and the texture map are decoded when first accessed.
+    If compact is set, meshes are model.ArrayMesh instead of model.Mesh."""
+    reader = WadReader(f, options, compact)
+    if lazy:
+        return lazy_wad(reader)
+
+    texture_map = reader.read_texture_map()
+    textureMaps = reader.read_texture_pages()
+    reader.decode_meshes()
+
+    #######################
+    ### POST PROCESSING ###
+    #######################
+
+    # collect all the data relative to each movable, the keyframes of
+    # all the animations are parsed at once
+    movables = []
+    keyframes_layouts = []
+    for mov_idx, mov_data in enumerate(reader.movables_data):
+        animations, layouts = reader.movable_animations(mov_idx)
+        keyframes_layouts += layouts
+        movables.append((mov_data.obj_ID, reader.read_movable_joints(mov_idx),
+                         animations))
+
+    keyframes = read_keyframes(reader.keyframes_data,
+                               [layout for _, layout in keyframes_layouts])
+    for (animation, _), animation_keyframes in zip(keyframes_layouts, keyframes):
+        animation.keyFrames = animation_keyframes
 
     # for each static
     statics_model = []
-    for static in statics_data:
-        mesh_pointer = mesh_pointers[static.pointers_index]
-        mesh_idx = next(addressIndex
-                        for addressIndex, mesh in enumerate(mesh_data)
-                        if mesh["idx"] == mesh_pointer)
-
-        mesh = read_mesh(mesh_data[mesh_idx],
-                         texture_samples, map_width, map_height, options)
+    for static_idx, static in enumerate(reader.statics_data):
+        mesh = reader.read_static_mesh(static_idx)
         statics_model.append(model.Static(static.obj_ID, mesh))
 
     movables_model = []
-    for movable in movables:
-        meshesTO = [mesh_data[i] for i in movable['mesh_indices']]
-        meshes = []
-        for meshto in meshesTO:
-            mesh = read_mesh(meshto, texture_samples, map_width, map_height, options)
-            meshes.append(mesh)
-
-        movable = model.Movable(
-            movable['idx'], meshes, movable['links'], movable['animations'])
+    for mov_idx, (obj_ID, joints, animations) in enumerate(movables):
+        meshes = reader.read_movable_meshes(mov_idx)
+        movable = model.Movable(obj_ID, meshes, joints, animations)
         movables_model.append(movable)
 
-    return model.Wad(version, statics_model, map_width, map_height, texture_map, movables_model, textureMaps)
+    reader.close()
+
+    return model.Wad(reader.version, statics_model, reader.map_width,
+                     reader.map_height, texture_map, movables_model, textureMaps)
+
+
+def iter_movables(reader, lookahead=8):
+    """yield the model.Movable of each movable of a WadReader
+
+    Movables are decoded lookahead at a time (their keyframes are decoded
+    at once), so at most lookahead movables are held besides the ones kept
+    by the caller. A mesh is built once for all the objects using it and
+    released from the reader after the last of them."""
+    movables_count = len(reader.movables_data)
+    for first in range(0, movables_count, lookahead):
+        batch = range(first, min(first + lookahead, movables_count))
+
+        movables = []
+        keyframes_layouts = []
+        for mov_idx in batch:
+            animations, layouts = reader.movable_animations(mov_idx)
+            keyframes_layouts += layouts
+            movables.append(model.Movable(
+                reader.movables_data[mov_idx].obj_ID,
+                reader.read_movable_meshes(mov_idx),
+                reader.read_movable_joints(mov_idx), animations))
+
+        keyframes = read_keyframes(reader.keyframes_data,
+                                   [layout for _, layout in keyframes_layouts])
+        for (animation, _), animation_keyframes in zip(keyframes_layouts, keyframes):
+            animation.keyFrames = animation_keyframes
+        del keyframes_layouts, keyframes
+
+        # the batch does not keep the movables already handed out
+        movables.reverse()
+        for mov_idx in batch:
+            yield movables.pop()
+            reader.release_meshes(reader.movable_mesh_pointers(mov_idx))
+
+
+def iter_statics(reader):
+    """yield the model.Static of each static of a WadReader, one at a time"""
+    for static_idx, static in enumerate(reader.statics_data):
+        yield model.Static(static.obj_ID, reader.read_static_mesh(static_idx))
+        reader.release_meshes(reader.static_mesh_pointers(static_idx))
+
+
+def stream_wad(f, options, lookahead=8, compact=False):
+    """same as readWAD(f, options, lazy=True), but movables and statics are
+    the iter_movables and iter_statics generators, to be iterated once"""
+    reader = WadReader(f, options, compact)
+    return model.LazyWad(reader.version, iter_statics(reader), reader.map_width,
+                         reader.map_height, reader.read_texture_map,
+                         iter_movables(reader, lookahead), reader.read_texture_pages,
+                         reader.close)
+
+
+def lazy_wad(reader):
+    movables = []
+    for mov_idx, mov_data in enumerate(reader.movables_data):
+        movable = model.LazyMovable(
+            mov_data.obj_ID, reader.read_movable_joints(mov_idx),
+            partial(reader.read_movable_meshes, mov_idx),
+            partial(reader.read_movable_animations, mov_idx))
+        movables.append(movable)
+
+    statics = []
+    for static_idx, static in enumerate(reader.statics_data):
+        static = model.LazyStatic(
+            static.obj_ID, partial(reader.read_static_mesh, static_idx))
+        statics.append(static)
+
+    return model.LazyWad(reader.version, statics, reader.map_width,
+                         reader.map_height, reader.read_texture_map, movables,
+                         reader.read_texture_pages, reader.close)